@@ -0,0 +1,95 @@
+'''
+Static background model for rigs with steady lighting: the median of a sparse sample of frames, taken across
+every video of a session, so the animals (which move between samples) drop out of it. It is built once, cached
+as background_<key>.png (the key is a hash of the videos it was built from), and shared by every video in the
+batch. Foreground is then a cheap absdiff + threshold against it, with no model to warm up.
+
+MOG2 (the default) adapts to changes in the lighting, so stay with it for rigs where the lighting drifts.
+'''
+
+import cv2 as cv
+import hashlib
+import numpy as np
+import os
+
+
+def canOpen(file):
+    video = cv.VideoCapture(file)
+    opened = video.isOpened()
+    video.release()
+    if not opened:
+        print(f"WARNING: could not open {file}, leaving it out of the background")
+
+    return opened
+
+
+def sampleFrames(videos, count=25):
+    # At most `count` frames spread evenly over the videos; with more videos than that, over an even subset of
+    # them. Videos that can't be opened (or are a different size) are skipped with a warning, so one bad file
+    # doesn't stop the batch.
+    videos = [file for file in videos if canOpen(file)]
+    if len(videos) > count:
+        videos = [videos[int((k + 0.5) * len(videos) / count)] for k in range(count)]
+    frames = []
+    for j, file in enumerate(videos):
+        video = cv.VideoCapture(file)
+        total = int(video.get(cv.CAP_PROP_FRAME_COUNT))
+        # Shares of count that add up to it
+        perVideo = count // len(videos) + (j < count % len(videos))
+        for k in range(perVideo):
+            video.set(cv.CAP_PROP_POS_FRAMES, int((k + 0.5) * total / perVideo))
+            ret, frame = video.read()
+            if not ret:
+                continue
+            if frames and frame.shape != frames[0].shape:
+                print(f"WARNING: {file} is not the same size as the other videos, leaving it out of the background")
+                break
+            frames.append(frame)
+        video.release()
+
+    if not frames:
+        raise IOError("Could not read any frames to build the background from")
+    return frames
+
+
+def medianBackground(videos, count=25):
+    return np.median(np.stack(sampleFrames(videos, count)), axis=0).astype(np.uint8)
+
+
+def backgroundKey(videos, count):
+    # Hash of the videos' names, sizes and modification times, and how many frames were sampled
+    digest = hashlib.sha1(str(count).encode())
+    for file in sorted(videos, key=os.path.basename):
+        stat = os.stat(file)
+        digest.update(f"{os.path.basename(file)}:{stat.st_size}:{stat.st_mtime}".encode())
+
+    return digest.hexdigest()
+
+
+def loadOrBuildBackground(videos, cacheDir='.', count=25):
+    # Reuse the saved background for this set of videos, if there is one. Returns the path it is saved at.
+    path = os.path.join(cacheDir, f"background_{backgroundKey(videos, count)[:16]}.png")
+    if not os.path.exists(path):
+        cv.imwrite(path, medianBackground(videos, count))
+
+    return path
+
+
+class StaticBackground:
+    # Drop-in for a MOG2 subtractor: apply(frame, fgmask) returns 255 where the frame differs from the
+    # background by more than threshold (grey levels), 0 elsewhere. Buffers are reused from frame to frame.
+    def __init__(self, image, threshold=25):
+        self.image = image
+        self.threshold = threshold
+        self.diff = None
+        self.gray = None
+
+    def apply(self, image, fgmask=None):
+        self.diff = cv.absdiff(image, self.image, self.diff)
+        if self.diff.ndim == 3:
+            self.gray = cv.cvtColor(self.diff, cv.COLOR_BGR2GRAY, self.gray)
+        else:
+            self.gray = self.diff
+        _, fgmask = cv.threshold(self.gray, self.threshold, 255, cv.THRESH_BINARY, fgmask)
+
+        return fgmask
@@ -0,0 +1,68 @@
+'''
+Track a batch of videos across a pool of worker processes. Each job is a dict of trackVideo arguments
+(file, ROIs, protocol, csvPath, videoPath, ...). ROIs have to be chosen before the batch starts, since the
+workers make no GUI calls. A video that fails is reported and skipped; the rest of the batch carries on.
+'''
+
+import cv2 as cv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tracker import trackVideo
+
+
+def initWorker():
+    # Each worker tracks one video at a time, so stop OpenCV's own threads from oversubscribing the cores
+    cv.setNumThreads(1)
+
+
+def trackJob(job):
+    # Track one video, returning (file, frames tracked, seconds taken, error message or None) rather than
+    # raising, so a single bad video does not take the batch down with it
+    name = os.path.basename(job['file'])
+
+    def report(done, total):
+        print(f"{name}: {done}/{total} frames", flush=True)
+
+    start = time.perf_counter()
+    try:
+        frames = trackVideo(**job, progress=report)
+    except Exception as e:
+        return job['file'], 0, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+    return job['file'], frames, time.perf_counter() - start, None
+
+
+def printResult(n, total, result):
+    file, frames, seconds, error = result
+    name = os.path.basename(file)
+    if error is None:
+        print(f"[{n}/{total}] finished {name}: {frames} frames in {seconds:.1f}s "
+              f"({frames / max(seconds, 1e-9):.1f} fps)")
+    else:
+        print(f"[{n}/{total}] FAILED {name}: {error}")
+
+
+def trackBatch(jobs, workers=None):
+    # Track every job using `workers` processes (default: one per core). workers=1 runs the jobs one after
+    # another in this process. Returns the result of every job, in the order they finished.
+    results = []
+    if workers == 1:
+        for job in jobs:
+            results.append(trackJob(job))
+            printResult(len(results), len(jobs), results[-1])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker) as pool:
+        futures = {pool.submit(trackJob, job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. crashed inside OpenCV)
+                result = (futures[future]['file'], 0, 0.0, f"{type(e).__name__}: {e}")
+
+            results.append(result)
+            printResult(len(results), len(jobs), result)
+
+    return results
@@ -0,0 +1,155 @@
+'''
+Compare the throughput of the tracking loop in its different modes on a real video:
+
+    python benchmark.py video.mp4 --rois rois.json
+
+Each mode tracks the whole video, writing the CSV and the annotated video into a temporary folder. The
+frames/sec of each mode is printed next to the plain serial loop, along with how far its centroids are from
+the serial loop's (median / mean / max distance in pixels) and how often it puts the animal in the same zone.
+
+With --centroid, only the centroid methods are compared, on the masks produced while tracking the video.
+'''
+
+import argparse
+import csv
+import cv2 as cv
+import numpy as np
+import os
+import tempfile
+import time
+from background import loadOrBuildBackground
+from selectROIs import loadROIs
+from centroid import centroid
+from tracker import Tracker, trackVideo
+
+
+# Name and trackVideo options of each mode; the first is the baseline the others are compared against
+MODES = [
+    ('serial', {}),
+    ('pipelined', {'pipelined': True}),
+    ('region=rois', {'region': 'rois'}),
+    ('region=bbox', {'region': 'bbox'}),
+    ('scale=0.5', {'scale': 0.5}),
+    ('scale=0.25', {'scale': 0.25}),
+    ('region=rois scale=0.5', {'region': 'rois', 'scale': 0.5}),
+    ('centroid=components', {'centroidMethod': 'components'}),
+    ('predict', {'predict': True}),
+    ('threshold=128', {'threshold': 128}),
+    ('stride=2', {'stride': 2}),
+    ('stride=4', {'stride': 4}),
+    ('background=median', {'background': 'median'}),
+]
+
+CENTROID_METHODS = ['contours', 'components']
+
+
+def modeOptions(options, video, cacheDir):
+    # trackVideo options of a mode; a median background is built from the video first (and not timed)
+    if options.get('background') == 'median':
+        return {**options, 'background': loadOrBuildBackground([video], cacheDir)}
+
+    return options
+
+
+def readTrajectory(csvPath):
+    # x, y and location of every row of a trajectory CSV
+    with open(csvPath, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    points = np.array([[float(row['x']), float(row['y'])] for row in rows]).reshape(-1, 2)
+    locations = np.array([row['location'] for row in rows])
+
+    return points, locations
+
+
+def trajectoryError(trajectory, reference):
+    # Median, mean and max distance between matching rows of two trajectories, and the fraction of rows
+    # where they agree on the zone
+    n = min(len(trajectory[0]), len(reference[0]))
+    distance = np.hypot(*(trajectory[0][:n] - reference[0][:n]).T)
+    agreement = np.mean(trajectory[1][:n] == reference[1][:n])
+
+    return np.median(distance), distance.mean(), distance.max(), agreement
+
+
+def timeRun(label, run):
+    start = time.perf_counter()
+    frames = run()
+    seconds = time.perf_counter() - start
+    fps = frames / max(seconds, 1e-9)
+    print(f"{label:<24} {frames:>7} frames {seconds:>8.2f}s {fps:>8.1f} fps", end='')
+
+    return fps
+
+
+def collectMasks(video, ROIs, maxFrames):
+    # The processed ROI masks centroid() sees while tracking the first maxFrames frames of a video
+    capture = cv.VideoCapture(video)
+    tracker = Tracker(ROIs)
+    masks = []
+    while len(masks) < maxFrames * len(ROIs):
+        ret, frame = capture.read()
+        if not ret:
+            break
+        processed = tracker.masks(frame)[0]
+        masks.extend(processed[y:y+h, x:x+w].copy() for x, y, w, h in tracker.ROIs)
+    capture.release()
+
+    return masks
+
+
+def benchmarkCentroid(video, ROIs, maxFrames=1000):
+    # Time each centroid method on real masks, and compare its centroids with the first method's
+    masks = collectMasks(video, ROIs, maxFrames)
+    reference = None
+    for method in CENTROID_METHODS:
+        start = time.perf_counter()
+        points = np.array([centroid(mask, method) for mask in masks])
+        seconds = time.perf_counter() - start
+        print(f"centroid {method:<15} {len(masks):>7} masks {seconds * 1e6 / max(len(masks), 1):>8.1f} us/mask", end='')
+
+        if reference is None:
+            reference = (seconds, points)
+            print()
+        else:
+            distance = np.hypot(*(points - reference[1]).T)
+            print(f" {reference[0] / seconds:>6.2f}x   difference mean {distance.mean():.2f}px "
+                  f"max {distance.max():.2f}px")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tracking loop in its different modes.")
+    parser.add_argument('video', help='video file to track')
+    parser.add_argument('--rois', required=True, help='JSON file of arena ROIs')
+    parser.add_argument('--protocol', default='OFT', choices=['OFT', 'SIT'])
+    parser.add_argument('--codec', default='H264', help='fourcc of the annotated output video')
+    parser.add_argument('--queue-size', type=int, default=16, help='frames buffered between pipeline stages')
+    parser.add_argument('--modes', nargs='+', help='only run these modes (the first is the baseline)')
+    parser.add_argument('--centroid', action='store_true',
+                        help='only compare the centroid methods, on the masks of the first --frames frames')
+    parser.add_argument('--frames', type=int, default=1000)
+    args = parser.parse_args()
+
+    ROIs = loadROIs(args.rois)
+    if args.centroid:
+        benchmarkCentroid(args.video, ROIs, args.frames)
+        exit()
+    modes = [mode for mode in MODES if args.modes is None or mode[0] in args.modes]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = None
+        for n, (label, options) in enumerate(modes):
+            csvPath = os.path.join(tmp, f'centroid_{n}.csv')
+            options = modeOptions(options, args.video, tmp)
+            fps = timeRun(label, lambda: trackVideo(args.video, ROIs, args.protocol, csvPath=csvPath,
+                                                    videoPath=os.path.join(tmp, 'tracked.mp4'),
+                                                    codec=args.codec, queueSize=args.queue_size, **options))
+            trajectory = readTrajectory(csvPath)
+
+            if baseline is None:
+                baseline = (fps, trajectory)
+                print()
+            else:
+                median, mean, worst, agreement = trajectoryError(trajectory, baseline[1])
+                print(f" {fps / baseline[0]:>6.2f}x   error median {median:.2f}px mean {mean:.2f}px max {worst:.2f}px"
+                      f"   zone agreement {agreement:.2%}")
@@ -1,15 +1,45 @@
 import cv2 as cv
+import numpy as np
+from collections import namedtuple
 
 
-def centroid(fgndMask):
-    # Find all the contours in the image
-    contours, hierarchy = cv.findContours(fgndMask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
+# A connected foreground region: its area in pixels, centroid, and bounding box (x, y, w, h)
+Blob = namedtuple('Blob', ['area', 'x', 'y', 'bbox'])
+
+
+def blobs(fgndMask, n=1, minArea=0):
+    # The n largest blobs in the mask (all of them if n is None), largest first. A single
+    # connectedComponentsWithStats pass gives the area, centroid and bounding box of every blob.
+
+    # Foreground masks are mostly empty, so only label the part of the mask that has foreground in it
+    bx, by, bw, bh = cv.boundingRect(fgndMask)
+    if bw == 0 or bh == 0:
+        return []
+    count, labels, stats, centroids = cv.connectedComponentsWithStatsWithAlgorithm(
+        fgndMask[by:by+bh, bx:bx+bw], 8, cv.CV_32S, cv.CCL_BBDT)
+
+    # Label 0 is the background
+    areas = stats[1:, cv.CC_STAT_AREA]
+    order = np.argsort(areas)[::-1]
+    if n is not None:
+        order = order[:n]
 
-    contour_area = []
-    for c in contours:
-        contour_area.append(cv.contourArea(c))
+    return [Blob(int(areas[k]), float(centroids[k + 1, 0]) + bx, float(centroids[k + 1, 1]) + by,
+                 (int(stats[k + 1, 0]) + bx, int(stats[k + 1, 1]) + by, int(stats[k + 1, 2]), int(stats[k + 1, 3])))
+            for k in order if areas[k] >= minArea]
 
-    contour_area = sorted(contour_area, reverse=True)
+
+def largestBlob(fgndMask, method='contours'):
+    # Centroid and area of the largest object in the mask; ((0, 0), 0) if there is none
+    if method == 'components':
+        # Centroid of the largest connected component
+        largest = blobs(fgndMask, 1)
+        if largest:
+            return (largest[0].x, largest[0].y), largest[0].area
+        return (0, 0), 0
+
+    # Find all the contours in the image
+    contours, hierarchy = cv.findContours(fgndMask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
 
     try:
         largest_contour = max(contours, key=cv.contourArea)
@@ -21,7 +51,11 @@ def centroid(fgndMask):
         m = cv.moments(largest_contour)
         p = (m['m10'] / (m['m00'] + 1e-5), m['m01'] / (m['m00'] + 1e-5))
 
-        return p
+        return p, m['m00']
     else:
         p = (0,0)
-        return p
\ No newline at end of file
+        return p, 0
+
+
+def centroid(fgndMask, method='contours'):
+    return largestBlob(fgndMask, method)[0]
@@ -0,0 +1,59 @@
+'''
+Checkpoints for resuming a long tracking run (trackVideo's checkpointPath, --checkpoint). Every so often the
+tracker saves, as JSON, where it has got to: the last frame written, the frames written so far, the size of
+each output file at that point, the last samples of each ROI, and the settings the video is being tracked
+with. A run that is stopped (a key press, Ctrl-C, a crash, a power cut) is resumed from its last checkpoint:
+the outputs are cut back to the sizes recorded and appended to, rather than written again.
+
+The background model can't be saved, so it is rebuilt instead: tracking restarts `warmup` seconds before the
+checkpoint, with nothing written until the checkpoint is reached (as at the start of a trial window). A static
+background (--background median) needs no warm-up.
+
+Once a video is done its checkpoint is marked complete, so running the same batch again skips it. A checkpoint
+taken with different settings, of a video that has since changed, or whose outputs have gone missing is ignored,
+and the video tracked again from the start.
+'''
+
+import json
+import os
+
+
+def videoIdentity(file):
+    # Enough to tell whether a video has changed since its checkpoint was taken
+    stat = os.stat(file)
+    return {'name': os.path.basename(file), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def loadCheckpoint(path, config):
+    # The checkpoint saved at path, if there is one and it was taken with the same config; otherwise None
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except ValueError:
+        # Not a checkpoint (edited by hand, say)
+        return None
+
+    if checkpoint.get('config') != json.loads(json.dumps(config)):
+        return None
+    # The outputs have to still be there, and at least as long as they were (see truncateOutput)
+    if not all(os.path.exists(path) and os.path.getsize(path) >= size for path, size in checkpoint['outputs'].items()):
+        return None
+
+    return checkpoint
+
+
+def saveCheckpoint(path, checkpoint):
+    # Write to a temporary file and move it into place, so a crash never leaves half a checkpoint
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def truncateOutput(path, size):
+    # Cut an output file back to its size at the checkpoint, dropping anything written after it
+    os.truncate(path, size)
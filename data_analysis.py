@@ -1,12 +1,56 @@
+import cv2 as cv
 import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt 
+import argparse
 import glob
+import hashlib
+import json
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from trajectory import toDataFrame, loadHeader
 
-def analysis(df, start):
-    fps = 32.318
+
+# Frame rate to fall back on when it can't be read from the trajectory or its video
+DEFAULT_FPS = 32.318
+
+# Order zones are listed in the summary table; zones not listed here follow, sorted
+ZONE_ORDER = ['edge', 'center', 'Left', 'Center', 'Right']
+
+
+def loadData(file):
+    # Read a tracked trajectory, either the CSV or the binary .traj file
+    if file.endswith('.traj'):
+        return toDataFrame(file)
+    # ROI labels are strings, as in the .traj, even when they are numbers (3 or more arenas)
+    return pd.read_csv(file, dtype={'rectangle': str})
+
+
+def videoFps(file, default=DEFAULT_FPS):
+    # Frame rate of the video a trajectory was tracked from. .traj files store it; for a CSV called
+    # centroid_<name>.csv look for <name>.mp4 next to it or in the folder above (OFT_folder.py's layout).
+    if file.endswith('.traj'):
+        fps = loadHeader(file).get('fps')
+        if fps:
+            return fps
+
+    name = os.path.splitext(os.path.basename(file))[0]
+    if name.startswith('centroid_'):
+        name = name[len('centroid_'):]
+    folder = os.path.dirname(os.path.abspath(file))
+    for video in (os.path.join(folder, f"{name}.mp4"), os.path.join(os.path.dirname(folder), f"{name}.mp4")):
+        if os.path.exists(video):
+            capture = cv.VideoCapture(video)
+            fps = capture.get(cv.CAP_PROP_FPS)
+            capture.release()
+            if fps > 0:
+                return fps
+
+    return default
+
+
+def analysis(df, start, fps=DEFAULT_FPS):
     # Drop data points before start time
     start_frame = int(start * fps)
     df = df.drop(df.index[:start_frame])
@@ -38,81 +82,204 @@ def analysis(df, start):
     return df
 
 
+def analyzeAll(df, starts=None, fps=DEFAULT_FPS, duration=600, arenaSize=48):
+    # Same analysis as analysis(), for every animal (ROI) in a trajectory at once. starts maps an ROI label
+    # to the start of its test in seconds (default 0), and each test lasts `duration` seconds. Returns the
+    # analysed rows of every animal, indexed by frame within the animal's own trajectory, and a summary
+    # table with a column per ROI. Trajectories tracked over a trial window (which have a frame column)
+    # are indexed by video frame instead, so the start times still line up.
+    starts = starts or {}
+    groups = df.groupby('rectangle', sort=False)
+    position = df['frame'] if 'frame' in df.columns else groups.cumcount()
+
+    # Keep each animal's test window
+    start_frame = df['rectangle'].map({label: int(starts.get(label, 0) * fps) for label in groups.groups})
+    keep = (position >= start_frame) & (position < start_frame + int(duration * fps))
+    df = df[keep].copy()
+    groups = df.groupby('rectangle', sort=False)
+
+    # 'unit' is the number of pixels / cm, assuming the mean of each arena's x and y extent is arenaSize cm
+    extent_x = groups['x'].transform('max') - groups['x'].transform('min')
+    extent_y = groups['y'].transform('max') - groups['y'].transform('min')
+    unit = (extent_x + extent_y) / 2 / arenaSize
+
+    df['distance'] = ((groups['x'].diff() ** 2 + groups['y'].diff() ** 2) ** 0.5) / unit
+    df['rolling average distance'] = groups['distance'].rolling(5).mean().droplevel(0)
+
+    groups = df.groupby('rectangle', sort=False)
+    # (Series.cumsum per animal, rather than groupby's compensated cumsum, to give the same numbers as analysis())
+    df['cumulative distance'] = groups['rolling average distance'].transform(pd.Series.cumsum)
+    df['velocity'] = np.abs(groups['rolling average distance'].diff() / (1/fps))
+    df.index = position[keep]
+
+    # Time spent in each zone, then distance and speed
+    counts = df.groupby(['rectangle', 'location'], sort=False).size().unstack(fill_value=0)
+    zones = [z for z in ZONE_ORDER if z in counts.columns] + sorted(z for z in counts.columns if z not in ZONE_ORDER)
+    summary = (counts[zones] / fps).rename(columns=lambda z: f"{z.capitalize()} time")
+    summary.columns.name = None
+    groups = df.groupby('rectangle', sort=False)
+    summary['Cumulative distance'] = groups['rolling average distance'].sum()
+    summary['Average speed'] = groups['velocity'].mean()
+
+    return df, summary.T
+
+
+def animalIds(file, labels):
+    # Animal ID of each ROI. Two-arena files are named after the pair, e.g. 10961-62 holds 10961 on the
+    # left and 10962 on the right; anything else is named <file>_<ROI>
+    match = re.search(r'(\d{5}-\d{2})', os.path.basename(file))
+    if match and set(labels) == {'LEFT', 'RIGHT'}:
+        nums = match.group(1).split('-')
+        return {'LEFT': nums[0], 'RIGHT': nums[0][:3] + nums[1]}
+
+    base_name = os.path.splitext(os.path.basename(file))[0]
+    return {label: f"{base_name}_{label}" for label in labels}
+
+
+def analysedPath(outputDir, animal):
+    return os.path.join(outputDir, f'OFT_{animal}_analyzed.csv')
+
+
+def analyzeFile(file, outputDir, starts, duration=600, arenaSize=48):
+    # Analyse one trajectory file and save each animal's analysis under its ID. Returns the file, the ID of
+    # each ROI, the frame rate used, and the summary values of each animal.
+    df = loadData(file)
+
+    # Get the animal numbers from file name, and the frame rate of the video
+    ids = animalIds(file, df['rectangle'].unique())
+    fps = videoFps(file)
+
+    # Analyze data for every animal in the file
+    analysed, animals = analyzeAll(df, {label: starts.get(animal, 0) for label, animal in ids.items()}, fps,
+                                   duration, arenaSize)
+
+    # Save analysis under animal ID#
+    for label, animal_df in analysed.groupby('rectangle', sort=False):
+        animal_df.to_csv(analysedPath(outputDir, ids[label]))
+
+    return file, ids, fps, animals.rename(columns=ids).to_dict()
+
+
+def fileHash(file):
+    digest = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def analysisParameters(ids, starts, duration, arenaSize, fps):
+    # Everything besides the file's contents that its results depend on
+    return {'starts': {animal: starts.get(animal, 0) for animal in sorted(ids.values())},
+            'duration': duration, 'arena_size': arenaSize, 'fps': fps}
+
+
+def trajectoryFiles(folder):
+    # The trajectories in a folder, one per video: with --output-format both a video has a CSV and a .traj,
+    # which would give its animals twice, so the .traj (full precision coordinates) is used
+    files = {}
+    for file in sorted(glob.glob(os.path.join(folder, '*.csv')) + glob.glob(os.path.join(folder, '*.traj'))):
+        stem, ext = os.path.splitext(file)
+        if stem not in files or ext == '.traj':
+            files[stem] = file
+
+    return sorted(files.values())
+
+
+def analyzeFolder(files, outputDir, starts, duration=600, arenaSize=48, workers=None):
+    # Analyse every trajectory in files across a process pool and write summary_data.csv. A manifest of each
+    # file's content hash, analysis parameters and summary values is kept in outputDir, so only new or
+    # changed files are analysed again, along with files whose start times or frame rate changed (a CSV's
+    # video found or replaced, say) and files whose analysed CSVs have gone missing.
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    manifestPath = os.path.join(outputDir, 'analysis_manifest.json')
+    manifest = {}
+    if os.path.exists(manifestPath):
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+
+    # Files are looked up by name; the hash is only recomputed when the size or modification time changed
+    todo = []
+    for file in files:
+        name = os.path.basename(file)
+        entry = manifest.get(name)
+        stat = os.stat(file)
+        if entry is not None and (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime):
+            if entry['hash'] == fileHash(file):
+                entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+            else:
+                entry = None
+        if (entry is None
+                or entry['parameters'] != analysisParameters(entry['ids'], starts, duration, arenaSize, videoFps(file))
+                or not all(os.path.exists(analysedPath(outputDir, animal)) for animal in entry['ids'].values())):
+            todo.append(file)
+    print(f"{len(todo)} of {len(files)} files to analyse")
+
+    def record(file, ids, fps, animals):
+        stat = os.stat(file)
+        manifest[os.path.basename(file)] = {
+            'hash': fileHash(file), 'size': stat.st_size, 'mtime': stat.st_mtime, 'ids': ids,
+            'parameters': analysisParameters(ids, starts, duration, arenaSize, fps), 'summary': animals,
+        }
+        print(f"analysed {os.path.basename(file)}: {', '.join(ids.values())}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyzeFile, file, outputDir, starts, duration, arenaSize): file for file in todo}
+        for future in as_completed(futures):
+            try:
+                record(*future.result())
+            except Exception as e:
+                print(f"FAILED {os.path.basename(futures[future])}: {type(e).__name__}: {e}")
+
+    # Forget files that are no longer there, and save the manifest for next time
+    names = {os.path.basename(file) for file in files}
+    manifest = {name: entry for name, entry in manifest.items() if name in names}
+    with open(manifestPath, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    # Merge every animal's summary into one table
+    summary = pd.DataFrame({animal: values for name in sorted(manifest)
+                            for animal, values in manifest[name]['summary'].items()})
+    summary.index.name = 'parameters'
+    summary.reset_index().to_csv(os.path.join(outputDir, 'summary_data.csv'))
+
+    return summary
+
+
+# because you didn't crop the videos and had to input start times manually *clown emoji*
+# # OFT exp 1.1:
+# STARTS = {'10941': 18, '10942': 26, '10943': 30, '10944': 32, '10945': 25, '10946': 36,
+#           '10947': 26, '10948': 26, '10949': 9, '10950': 11, '10951': 17, '10952': 15,
+#           '10953': 17, '10954': 11, '10955': 13, '10956': 12, '10957': 11, '10958': 8,
+#           '10959': 14, '10960': 10}
+# OFT exp 1.2:
+STARTS = {'10961': 31, '10962': 33, '10963': 21, '10964': 14, '10965': 54, '10966': 54,
+          '10967': 20, '10968': 20, '10969': 48, '10970': 48, '10971': 31, '10972': 33,
+          '10973': 30, '10974': 32, '10975': 15, '10976': 13, '10977': 30, '10978': 32,
+          '10979': 34, '10980': 36}
+
+
 if __name__ == "__main__":
-    # Create dataframe for summary data across all animals in folder
-    summary = pd.DataFrame()
-    summary['parameters'] = ['Edge time', 'Center time', 'Cumulative distance', 'Average speed']
-
-    # because you didn't crop the videos and had to input start times manually *clown emoji*
-    # # OFT exp 1.1:
-    # starts = {'10941': 18, '10942': 26, '10943': 30, '10944': 32, '10945': 25, '10946': 36,
-    #           '10947': 26, '10948': 26, '10949': 9, '10950': 11, '10951': 17, '10952': 15,
-    #           '10953': 17, '10954': 11, '10955': 13, '10956': 12, '10957': 11, '10958': 8,
-    #           '10959': 14, '10960': 10}
-    # OFT exp 1.2:
-    starts = {'10961': 31, '10962': 33, '10963': 21, '10964': 14, '10965': 54, '10966': 54,
-              '10967': 20, '10968': 20, '10969': 48, '10970': 48, '10971': 31, '10972': 33,
-              '10973': 30, '10974': 32, '10975': 15, '10976': 13, '10977': 30, '10978': 32,
-              '10979': 34, '10980': 36}
-
-    for file in glob.glob('/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_2OFT/output_csv/*.csv'):
-        base_name = os.path.basename(file)
-        df = pd.read_csv(file)
-
-        # Get the animal numbers from file name
-        pattern = '(\d{5}-\d{2})'
-        match = re.search(pattern, file)
-        if match:
-            section = match.group(1)
-            print(section)
-        nums = section.split('-')
-        large = nums[0][:3]
-        left_num = nums[0]
-        right_num = large + nums[1]
-
-        # Split the main dataframe in 2 for the animals on the left / right
-        left_df = df[df['rectangle'] == 'LEFT'].reset_index(drop=True)
-        right_df = df[df['rectangle'] == 'RIGHT'].reset_index(drop=True)
-
-        # Get video data and length of test
-        fps = 32.318
-        seconds = left_df.shape[0] / fps
-        test_range = np.arange(0, seconds, 1/fps)
-
-        # Analyze data for left and right animals
-        left_df = analysis(left_df, starts[left_num])
-        right_df = analysis(right_df, starts[right_num])
-
-        # Save analysis under animal ID#
-        left_df.to_csv(f'/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_2OFT/analysed_csv/OFT_{left_num}_analyzed.csv')
-        right_df.to_csv(f'/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_2OFT/analysed_csv/OFT_{right_num}_analyzed.csv')
-
-        # Calculate edge and center time for summary table 
-        # Right/left edge time (ret/let)
-        df = left_df[left_df['location'] == 'edge'].reset_index(drop=True)
-        let = df.shape[0] / fps
-        df = right_df[right_df['location'] == 'edge'].reset_index(drop=True)
-        ret = df.shape[0] / fps
-
-        # Right/left center time (rct/lct)
-        df = left_df[left_df['location'] == 'center'].reset_index(drop=True)
-        lct = df.shape[0] / fps
-        df = right_df[right_df['location'] == 'center'].reset_index(drop=True)
-        rct = df.shape[0] / fps
-
-        times = [let, ret, lct, rct]
-        print(*times)
-
-        summary[f'{left_num}'] = [let, lct, left_df['rolling average distance'].sum(), left_df['velocity'].mean()]
-        summary[f'{right_num}'] = [ret, rct, right_df['rolling average distance'].sum(), right_df['velocity'].mean()]
-
-    
-    summary.to_csv('/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_2OFT/analysed_csv/summary_data.csv')
-        # # Small bins
-        # plt.hist2d(left_df['x'], left_df['y'], bins=(50, 50), cmap=plt.cm.jet)
-        # plt.show()
-        
-
-        
-    
+    parser = argparse.ArgumentParser(description="Analyse every tracked trajectory in a folder.")
+    parser.add_argument('folder', nargs='?',
+                        default='/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_2OFT/output_csv',
+                        help='folder of centroid CSV / .traj files')
+    parser.add_argument('--output',
+                        default='/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_2OFT/analysed_csv',
+                        help='folder for the analysed CSVs, the summary table and the manifest')
+    parser.add_argument('--starts', help='JSON file of test start times (s) by animal ID (default: OFT exp 1.2)')
+    parser.add_argument('--duration', type=float, default=600, help='length of the test (s)')
+    parser.add_argument('--arena-size', type=float, default=48, help='width of the arena (cm)')
+    parser.add_argument('--workers', type=int, help='number of files to analyse in parallel (default: one per core)')
+    args = parser.parse_args()
+
+    starts = STARTS
+    if args.starts is not None:
+        with open(args.starts) as f:
+            starts = json.load(f)
 
+    files = trajectoryFiles(args.folder)
+    summary = analyzeFolder(files, args.output, starts, args.duration, args.arena_size, args.workers)
+    print(summary)
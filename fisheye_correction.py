@@ -1,96 +1,285 @@
+'''
+Corrects the lens distortion of every video in a folder using a chessboard calibration.
+
+The calibration (camera matrix, distortion coefficients and, for each video size, the new camera matrix
+and crop ROI) is saved to calibration_<key>.json, where the key is a hash of the calibration images, so
+re-running on a new batch of videos skips calibration entirely. Chessboards are found across a pool of
+processes and the corners of each image are cached in corners.json, so adding images to the set only
+processes the new ones. The rectification is computed once per video as fixed-point remap maps, so correcting
+a video is a single cv.remap per frame.
+
+    python fisheye_correction.py --images './calibration_images/*.jpg' --calibrate-only
+'''
+
 import cv2 as cv
 import numpy as np
+import argparse
 import glob
-import os 
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 
-if __name__ == "__main__":
+# Termination criteria
+criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def imageHash(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def calibrationKey(images):
+    # Hash of the contents of the calibration images, independent of the order they are listed in
+    digest = hashlib.sha1()
+    for fname in sorted(images, key=os.path.basename):
+        digest.update(bytes.fromhex(imageHash(fname)))
+
+    return digest.hexdigest()
+
+
+def findCorners(fname, pattern=(9, 6)):
+    # Returns the image size and the refined chessboard corners of one image (None if no board is found)
+    img = cv.imread(fname)
+    if img is None:
+        raise IOError(f"Could not read calibration image: {fname}")
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+
+    # Find the chess board corners, and refine them if found
+    ret, corners = cv.findChessboardCorners(gray, pattern, None)
+    if not ret:
+        return gray.shape[::-1], None
+
+    corners2 = cv.cornerSubPix(gray, corners, (11,11), (-1,-1), criteria)
+    return gray.shape[::-1], corners2.reshape(-1, 2)
+
 
+def detectCorners(images, pattern=(9, 6), cacheDir='.', workers=None):
+    # Corners of every image, found across a pool of processes. Results are cached per image (by content
+    # hash) in corners.json, so adding images to a set only processes the new ones.
+    cachePath = os.path.join(cacheDir, 'corners.json')
+    cache = {}
+    if os.path.exists(cachePath):
+        with open(cachePath) as f:
+            cache = json.load(f)
+
+    keys = [f"{imageHash(fname)}_{pattern[0]}x{pattern[1]}" for fname in images]
+    missing = [(fname, key) for fname, key in zip(images, keys) if key not in cache]
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            found = pool.map(findCorners, [fname for fname, _ in missing], [pattern] * len(missing))
+            for (fname, key), (size, corners) in zip(missing, found):
+                cache[key] = {'size': list(size), 'corners': None if corners is None else corners.tolist()}
+
+        with open(cachePath, 'w') as f:
+            json.dump(cache, f)
+
+    print(f"found chessboards in {len(missing)} new images, {len(images) - len(missing)} cached")
+    return [cache[key] for key in keys]
+
+
+def calibrate(images, pattern=(9, 6), show=True, cacheDir='.', workers=None):
     # Code from opencv docs https://docs.opencv.org/4.x/dc/dbb/tutorial_py_calibration.html
-    
-    # Termination criteria
-    criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
-    # prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(6,5,0)
-    objp = np.zeros((9*6,3), np.float32)
-    objp[:,:2] = np.mgrid[0:9,0:6].T.reshape(-1,2)
+    # prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(8,5,0)
+    objp = np.zeros((pattern[0] * pattern[1], 3), np.float32)
+    objp[:,:2] = np.mgrid[0:pattern[0],0:pattern[1]].T.reshape(-1,2)
     # Arrays to store object points and image points from all the images.
     objpoints = [] # 3d point in real world space
     imgpoints = [] # 2d points in image plane.
-    images = glob.glob('./calibration_images/*.jpg')
-    i = 0
-    for fname in images:
-        img = cv.imread(fname)
-        gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-        # Find the chess board corners
-        ret, corners = cv.findChessboardCorners(gray, (9,6), None)
-        # If found, add object points, image points (after refining them)
-        if ret == True:
-            objpoints.append(objp)
-            corners2 = cv.cornerSubPix(gray,corners, (11,11), (-1,-1), criteria)
-            imgpoints.append(corners2)
+    used = []
+    for fname, result in zip(images, detectCorners(images, pattern, cacheDir, workers)):
+        if result['corners'] is None:
+            continue
+
+        objpoints.append(objp)
+        imgpoints.append(np.array(result['corners'], np.float32).reshape(-1, 1, 2))
+        imageSize = tuple(result['size'])
+        used.append(fname)
+        if show:
             # Draw and display the corners
-            cv.drawChessboardCorners(img, (7,6), corners2, ret)
+            img = cv.imread(fname)
+            cv.drawChessboardCorners(img, pattern, imgpoints[-1], True)
             cv.imshow('img', img)
-            cv.imwrite(f'drawn_chess/drawn_chess_{i}.jpg', img)
             cv.waitKey(500)
+    if show:
+        cv.destroyAllWindows()
 
-        i +=0
-    cv.destroyAllWindows()
+    if not objpoints:
+        raise ValueError("No chessboard found in any calibration image")
 
-    # Undistort the videos: 
-    ret, mtx, dist, rvecs, tvecs = cv.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
+    rms, mtx, dist, rvecs, tvecs = cv.calibrateCamera(objpoints, imgpoints, imageSize, None, None)
 
-    # Process each frame again for undistortion
-    videos = glob.glob('/Volumes/Extreme SSD/Behavioural_pilot_videos/SIT/*.mp4')
+    # Reprojection error of each image, to spot bad detections
+    errors = {}
+    for fname, obj, img, rvec, tvec in zip(used, objpoints, imgpoints, rvecs, tvecs):
+        projected, _ = cv.projectPoints(obj, rvec, tvec, mtx, dist)
+        errors[os.path.basename(fname)] = float(np.sqrt(np.mean(np.sum((projected - img) ** 2, axis=2))))
 
-    # Unidistort all .mp4 videos in the chosen folder
-    for video_path in videos:
-        # Create video capture object
-        cap = cv.VideoCapture(video_path)
+    return {'mtx': mtx, 'dist': dist, 'image_size': list(imageSize), 'rms': rms, 'image_errors': errors,
+            'rectification': {}}
 
-        # Get video parameters
-        frameRate = cap.get(cv.CAP_PROP_FPS)
-        # frameSize = (int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)))
-        frameSize = (1887, 1023)
-        fourcc = cv.VideoWriter_fourcc(*'mp4v')
 
-        # Get the base file name 
-        file_name = os.path.basename(video_path)
-        split = file_name.split('.')
-        base_name = split[0]
+def printCalibration(calibration, path):
+    errors = calibration.get('image_errors', {})
+    print(f"calibration {path}: reprojection error {calibration['rms']:.3f}px over {len(errors)} images")
+    for name, error in sorted(errors.items(), key=lambda item: -item[1]):
+        print(f"    {name}: {error:.3f}px")
 
-        # Create output video object
-        output = cv.VideoWriter(f"/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_SIT/{base_name}.mp4", fourcc, frameRate, frameSize)
 
+def saveCalibration(path, calibration):
+    data = dict(calibration)
+    data['mtx'] = np.asarray(calibration['mtx']).tolist()
+    data['dist'] = np.asarray(calibration['dist']).tolist()
+    data['rectification'] = {size: {'new_camera_matrix': np.asarray(r['new_camera_matrix']).tolist(),
+                                    'roi': [int(v) for v in r['roi']]}
+                             for size, r in calibration['rectification'].items()}
 
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4)
 
-        # Loop through each frame of the video 
-        i = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
 
-            # Undistort the frame
-            h, w = frame.shape[:2]
-            newcameramtx, roi = cv.getOptimalNewCameraMatrix(mtx, dist, (w,h), 1, (w,h))
-            dst = cv.undistort(frame, mtx, dist, None, newcameramtx)
-            x, y, w, h = roi
-            dst = dst[y:y+h, x:x+w]
-            if i == 0:
-                print(type(dst))
-                print(dst.size)
-                print(dst.shape)
+def loadCalibration(path):
+    with open(path) as f:
+        calibration = json.load(f)
+
+    calibration['mtx'] = np.array(calibration['mtx'])
+    calibration['dist'] = np.array(calibration['dist'])
+    for r in calibration['rectification'].values():
+        r['new_camera_matrix'] = np.array(r['new_camera_matrix'])
+        r['roi'] = tuple(r['roi'])
+
+    return calibration
+
+
+def loadOrCalibrate(images, cacheDir='.', show=True, workers=None):
+    # Reuse the saved calibration for this set of images, if there is one. Returns the calibration and the
+    # path it is saved at.
+    path = os.path.join(cacheDir, f"calibration_{calibrationKey(images)[:16]}.json")
+    if os.path.exists(path):
+        return loadCalibration(path), path
+
+    calibration = calibrate(images, show=show, cacheDir=cacheDir, workers=workers)
+    saveCalibration(path, calibration)
+
+    return calibration, path
+
+
+def rectification(calibration, frameSize, path=None):
+    # New camera matrix and crop ROI for frames of the given (w, h). Computed once per frame size and, if
+    # path is given, saved with the calibration.
+    size = f"{frameSize[0]}x{frameSize[1]}"
+    if size not in calibration['rectification']:
+        newcameramtx, roi = cv.getOptimalNewCameraMatrix(calibration['mtx'], calibration['dist'],
+                                                         frameSize, 1, frameSize)
+        calibration['rectification'][size] = {'new_camera_matrix': newcameramtx, 'roi': tuple(int(v) for v in roi)}
+        if path is not None:
+            saveCalibration(path, calibration)
+
+    r = calibration['rectification'][size]
+    return r['new_camera_matrix'], r['roi']
+
+
+def undistortMaps(calibration, frameSize, path=None):
+    # Fixed-point maps taking a distorted frame to the corrected one, plus the crop ROI
+    newcameramtx, roi = rectification(calibration, frameSize, path)
+    map1, map2 = cv.initUndistortRectifyMap(calibration['mtx'], calibration['dist'], None, newcameramtx,
+                                            frameSize, cv.CV_16SC2)
+
+    return map1, map2, roi
+
+
+class PointCorrector:
+    # Maps points between a distorted video frame and the corrected, cropped frame correctVideo would write,
+    # so tracking can run on the raw footage and only the tracked coordinates are corrected
+    def __init__(self, calibration, frameSize, path=None):
+        self.mtx = calibration['mtx']
+        self.dist = calibration['dist']
+        self.newcameramtx, roi = rectification(calibration, frameSize, path)
+        self.offset = np.array(roi[:2], np.float64)
+
+    def undistort(self, points):
+        points = np.asarray(points, np.float64).reshape(-1, 1, 2)
+        corrected = cv.undistortPoints(points, self.mtx, self.dist, P=self.newcameramtx)
+
+        return corrected.reshape(-1, 2) - self.offset
+
+    def distort(self, points):
+        # Back to normalised camera coordinates, then through the lens model
+        points = np.asarray(points, np.float64).reshape(-1, 2) + self.offset
+        rays = np.hstack([points, np.ones((len(points), 1))]) @ np.linalg.inv(self.newcameramtx).T
+        distorted, _ = cv.projectPoints(rays.reshape(-1, 1, 3), np.zeros(3), np.zeros(3), self.mtx, self.dist)
+
+        return distorted.reshape(-1, 2)
+
+
+def correctVideo(video_path, output_path, calibration, path=None, show=False):
+    # Create video capture object
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open input video: {video_path}")
+
+    # Get video parameters
+    frameRate = cap.get(cv.CAP_PROP_FPS)
+    frameSize = (int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)))
+    map1, map2, (x, y, w, h) = undistortMaps(calibration, frameSize, path)
+
+    # Create output video object, the size of the cropped frames
+    fourcc = cv.VideoWriter_fourcc(*'mp4v')
+    output = cv.VideoWriter(output_path, fourcc, frameRate, (w, h))
+
+    # Loop through each frame of the video
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        # Undistort the frame
+        dst = cv.remap(frame, map1, map2, cv.INTER_LINEAR)
+        dst = dst[y:y+h, x:x+w]
+        output.write(dst)
+
+        if show:
             cv.imshow('Undistorted Frame', dst)
-            output.write(dst)
-            i+=1
-            if cv.waitKey(1) >= 0: 
+            if cv.waitKey(1) >= 0:
                 break
 
-        cap.release()
-        output.release()
+    cap.release()
+    output.release()
+    if show:
         cv.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Correct the lens distortion of every .mp4 video in a folder.")
+    parser.add_argument('--images', default='./calibration_images/*.jpg', help='glob of chessboard images')
+    parser.add_argument('--cache-dir', default='.', help='where calibration files are saved')
+    parser.add_argument('--videos', default='/Volumes/Extreme SSD/Behavioural_pilot_videos/SIT',
+                        help='folder of videos to correct')
+    parser.add_argument('--output', default='/Volumes/Extreme SSD/Behavioural_pilot_videos/calibrated_SIT',
+                        help='folder to write corrected videos to')
+    parser.add_argument('--show', action='store_true', help='show the chessboards and corrected frames')
+    parser.add_argument('--workers', type=int, help='processes used to find chessboards (default: one per core)')
+    parser.add_argument('--calibrate-only', action='store_true',
+                        help='calibrate (or load the saved calibration), report its error and stop')
+    args = parser.parse_args()
+
+    calibration, path = loadOrCalibrate(sorted(glob.glob(args.images)), args.cache_dir, args.show, args.workers)
+    printCalibration(calibration, path)
+
+    if args.calibrate_only:
+        exit()
+
+    # Unidistort all .mp4 videos in the chosen folder
+    for video_path in glob.glob(os.path.join(args.videos, '*.mp4')):
+        # Get the base file name
+        base_name = os.path.basename(video_path).split('.')[0]
+        try:
+            correctVideo(video_path, os.path.join(args.output, f"{base_name}.mp4"), calibration, path, args.show)
+        except IOError as e:
+            print(f"ERROR: {e}")
+            continue
         print("finished calibrating video")
 
-    print("finished correcting all videos")
\ No newline at end of file
+    print("finished correcting all videos")
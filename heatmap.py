@@ -0,0 +1,211 @@
+'''
+Occupancy heatmaps accumulated while tracking, so figures for a whole cohort never need the trajectories:
+
+    python OFT.py video.mp4 --rois rois.json --heatmap           # also writes heatmap_<video>.npz
+    python heatmap.py output_csv --output cohort                 # merges every heatmap_*.npz in a folder
+
+Each ROI's arena is split into a bins x bins grid, and every written sample adds one frame to the bin the animal
+is in, and its speed (px/s) to the same bin of a velocity-weighted grid. A sample with no blob counts at the
+animal's last known position (MOG2 fades out an animal that keeps still, so these are mostly frames where it
+isn't moving); samples before the animal is first found are left out. The grids are saved as .npz next to the
+trajectory once the whole video has been tracked, so a run that stops early leaves no heatmap behind.
+
+The merge command reads only the saved grids. It writes each animal's time near the wall (thigmotaxis), time in
+the centre and mean speed to heatmap_summary.csv, and the cohort's mean occupancy and speed maps, and every
+animal's occupancy map, as figures.
+'''
+
+import argparse
+import glob
+import math
+import numpy as np
+import os
+
+
+# Bins along each side of an arena; a multiple of 6, so the default wall band of 1/6 is a whole number of bins
+BINS = 36
+
+# Width of the band along the walls counted as thigmotaxis, as a fraction of the arena's side. The OFT centre
+# zone is 2/3 of the arena, which leaves 1/6 on each side.
+BORDER = 1 / 6
+
+
+class OccupancyGrid:
+    # Occupancy and velocity-weighted grids of each ROI of a tracker, filled in a frame at a time
+    def __init__(self, tracker, fps, bins=BINS):
+        self.labels = list(tracker.labels)
+        self.arenas = [tuple(arena) for arena in tracker.arenas]
+        self.protocol = tracker.protocol
+        self.fps = fps
+        self.bins = bins
+        self.roiIndex = {label: i for i, label in enumerate(self.labels)}
+
+        self.occupancy = np.zeros((len(self.labels), bins, bins))
+        self.speed = np.zeros((len(self.labels), bins, bins))
+        # Frames before each animal was first found, which are not in the grids
+        self.unseen = np.zeros(len(self.labels), np.int64)
+        # Last known position and frame of each animal
+        self.last = [None] * len(self.labels)
+
+    def add(self, samples):
+        for s in samples:
+            i = self.roiIndex[s.roi]
+            last = self.last[i]
+            if s.area:
+                x, y = s.x, s.y
+            elif last is not None:
+                x, y = last[0], last[1]
+            else:
+                self.unseen[i] += 1
+                continue
+
+            speed = 0.0
+            if last is not None and s.frame > last[2]:
+                speed = math.hypot(x - last[0], y - last[1]) * self.fps / (s.frame - last[2])
+            self.last[i] = (x, y, s.frame)
+
+            # Bin of the point within the arena; points just outside it go in the bins along its edge
+            ax, ay, aw, ah = self.arenas[i]
+            col = min(max(int((x - ax) * self.bins / aw), 0), self.bins - 1)
+            row = min(max(int((y - ay) * self.bins / ah), 0), self.bins - 1)
+            self.occupancy[i, row, col] += 1
+            self.speed[i, row, col] += speed
+
+    def state(self):
+        # Everything add() has built up, as plain lists for a checkpoint (see checkpoint.py)
+        return {'occupancy': self.occupancy.tolist(), 'speed': self.speed.tolist(), 'unseen': self.unseen.tolist(),
+                'last': self.last}
+
+    def restore(self, state):
+        self.occupancy = np.array(state['occupancy'])
+        self.speed = np.array(state['speed'])
+        self.unseen = np.array(state['unseen'], np.int64)
+        self.last = [None if last is None else tuple(last) for last in state['last']]
+
+    def save(self, path, video=None):
+        np.savez(path, labels=np.array(self.labels), arenas=np.array(self.arenas), protocol=self.protocol,
+                 fps=self.fps or np.nan, occupancy=self.occupancy, speed=self.speed, unseen=self.unseen,
+                 video=video or '')
+
+
+def loadGrids(path):
+    # The grids saved by OccupancyGrid.save, as a dict of arrays
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def wallMask(bins, border=BORDER):
+    # Bins whose centre is within border (a fraction of the side) of the arena's walls
+    centres = (np.arange(bins) + 0.5) / bins
+    near = np.minimum(centres, 1 - centres) < border
+
+    return near[:, None] | near[None, :]
+
+
+def animalGrids(files):
+    # Every animal's grids across the saved files, as {animal ID: (occupancy, speed, arena, fps)}
+    from data_analysis import animalIds
+
+    animals = {}
+    for file in files:
+        grids = loadGrids(file)
+        labels = [str(label) for label in grids['labels']]
+        ids = animalIds(file, labels)
+        for i, label in enumerate(labels):
+            animals[ids[label]] = (grids['occupancy'][i], grids['speed'][i], tuple(grids['arenas'][i]),
+                                   float(grids['fps']))
+
+    return animals
+
+
+def summarise(animals, border=BORDER, arenaSize=None):
+    # Time near the wall and in the centre (s, and as a fraction of the time tracked) and mean speed of each
+    # animal, from its grids. Speeds are in px/s, or cm/s given the arena's width in cm.
+    import pandas as pd
+
+    rows = {}
+    for animal, (occupancy, speed, arena, fps) in animals.items():
+        frames = occupancy.sum()
+        wall = occupancy[wallMask(occupancy.shape[0], border)].sum()
+        unit = arena[2] / arenaSize if arenaSize else 1.0
+        rows[animal] = {'Tracked time': frames / fps, 'Wall time': wall / fps, 'Centre time': (frames - wall) / fps,
+                        'Thigmotaxis': wall / frames if frames else np.nan,
+                        'Average speed': speed.sum() / frames / unit if frames else np.nan}
+
+    return pd.DataFrame(rows)
+
+
+def mergeGrids(animals):
+    # Cohort mean of each animal's occupancy as a fraction of its time, and the cohort's mean speed in each bin
+    occupancy = np.mean([o / max(o.sum(), 1) for o, s, arena, fps in animals.values()], axis=0)
+    frames = np.sum([o for o, s, arena, fps in animals.values()], axis=0)
+    speed = np.sum([s for o, s, arena, fps in animals.values()], axis=0) / np.maximum(frames, 1)
+
+    return occupancy, speed
+
+
+def plotCohort(animals, outputDir, border=BORDER):
+    # Only imported when figures are actually drawn
+    from matplotlib import pyplot as plt
+
+    occupancy, speed = mergeGrids(animals)
+    edge = border * occupancy.shape[0] - 0.5
+    fig, axes = plt.subplots(1, 2, figsize=(10, 4.5))
+    for ax, grid, title in ((axes[0], occupancy, f"Mean occupancy ({len(animals)} animals)"),
+                            (axes[1], speed, "Mean speed (px/s)")):
+        image = ax.imshow(grid, cmap='inferno')
+        side = occupancy.shape[0] - 2 * edge - 1
+        ax.add_patch(plt.Rectangle((edge, edge), side, side, fill=False, edgecolor='white', linestyle='--'))
+        ax.set_title(title)
+        ax.axis('off')
+        fig.colorbar(image, ax=ax, fraction=0.046)
+    fig.savefig(os.path.join(outputDir, 'cohort_heatmap.png'), dpi=150, bbox_inches='tight')
+    plt.close(fig)
+
+    # Every animal's occupancy, on the same colour scale, tiled into one image (one axes per animal is slow
+    # to draw for a large cohort)
+    names = sorted(animals)
+    bins = occupancy.shape[0]
+    cols = min(len(names), 10)
+    rows = math.ceil(len(names) / cols)
+    # Each tile has a gap above it for the animal's ID, and one to its right
+    top, width, height = bins // 4, bins + 2, bins + bins // 4 + 1
+    tiles = np.full((rows * height, cols * width), np.nan)
+    for k, name in enumerate(names):
+        grid = animals[name][0]
+        r, c = divmod(k, cols)
+        tiles[r * height + top:r * height + top + bins, c * width:c * width + bins] = grid / max(grid.sum(), 1)
+    fig, ax = plt.subplots(figsize=(1.2 * cols, 1.4 * rows))
+    ax.imshow(tiles, cmap='inferno')
+    for k, name in enumerate(names):
+        r, c = divmod(k, cols)
+        ax.text(c * width, r * height + top - 1, name, fontsize=5, va='bottom')
+    ax.axis('off')
+    fig.savefig(os.path.join(outputDir, 'animal_heatmaps.png'), dpi=200, bbox_inches='tight')
+    plt.close(fig)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the occupancy heatmaps saved while tracking a cohort.")
+    parser.add_argument('folder', help='folder of heatmap_*.npz files')
+    parser.add_argument('--output', help='folder for the figures and summary table (default: the input folder)')
+    parser.add_argument('--border', type=float, default=BORDER,
+                        help='width of the wall band, as a fraction of the arena (default 1/6)')
+    parser.add_argument('--arena-size', type=float, help='width of the arena (cm), to give speeds in cm/s')
+    parser.add_argument('--no-figures', action='store_true', help='only write the summary table')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.folder, 'heatmap_*.npz')))
+    if not files:
+        raise SystemExit(f"No heatmap_*.npz files in {args.folder}")
+    output = args.output or args.folder
+    if not os.path.exists(output):
+        os.makedirs(output)
+
+    animals = animalGrids(files)
+    summary = summarise(animals, args.border, args.arena_size)
+    summary.index.name = 'parameters'
+    summary.reset_index().to_csv(os.path.join(output, 'heatmap_summary.csv'))
+    print(summary)
+    if not args.no_figures:
+        plotCohort(animals, output, args.border)
+    print(f"merged {len(animals)} animals from {len(files)} files into {output}")
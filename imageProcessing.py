@@ -1,13 +1,59 @@
 import cv2 as cv
+import numpy as np
 
 
-def imgProc(fgndMask):
-    structuringElement = cv.getStructuringElement(cv.MORPH_RECT, (5, 5))
+def scaledKernelSize(scale, size=5):
+    # Kernel size to use on a mask resized by `scale`, so filtering covers the same area of the arena
+    # (always odd, as GaussianBlur requires)
+    scaled = max(1, int(round(size * scale)))
+    if scaled % 2 == 0:
+        scaled += 1
 
-    fgndMask = cv.GaussianBlur(fgndMask, (5, 5), 0)
+    return scaled
+
+
+def imgProc(fgndMask, kernelSize=5):
+    structuringElement = cv.getStructuringElement(cv.MORPH_RECT, (kernelSize, kernelSize))
+
+    fgndMask = cv.GaussianBlur(fgndMask, (kernelSize, kernelSize), 0)
     _, fgndMask = cv.threshold(fgndMask, 128, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
     
     fgndMask = cv.morphologyEx(fgndMask, cv.MORPH_CLOSE, structuringElement, iterations=2)
     fgndMask = cv.morphologyEx(fgndMask, cv.MORPH_OPEN, structuringElement, iterations=2)
 
-    return fgndMask
\ No newline at end of file
+    return fgndMask
+
+
+class MaskProcessor:
+    # imgProc for a stream of masks of the same size. The kernels are built once and every step writes into
+    # buffers that are reused from frame to frame. Repeated closing / opening with a rectangle is the same
+    # as a single dilation or erosion with a larger rectangle, so close x2 then open x2 is done as
+    # dilate -> erode -> dilate (the two erosions in the middle merge into one).
+    # threshold=None picks the threshold with Otsu, as imgProc does; MOG2 masks only hold 0 / 127 (shadow)
+    # / 255, so a fixed threshold (e.g. 128) gives nearly the same mask for less work.
+    def __init__(self, kernelSize=5, iterations=2, threshold=None):
+        self.kernelSize = kernelSize
+        self.threshold = threshold
+
+        size = kernelSize + (iterations - 1) * (kernelSize - 1)
+        self.dilateElement = cv.getStructuringElement(cv.MORPH_RECT, (size, size))
+        self.erodeElement = cv.getStructuringElement(cv.MORPH_RECT, (2 * size - 1, 2 * size - 1))
+
+        self.buffers = None
+
+    def apply(self, fgndMask):
+        if self.buffers is None or self.buffers[0].shape != fgndMask.shape:
+            self.buffers = (np.empty_like(fgndMask), np.empty_like(fgndMask))
+        a, b = self.buffers
+
+        cv.GaussianBlur(fgndMask, (self.kernelSize, self.kernelSize), 0, dst=a)
+        if self.threshold is None:
+            cv.threshold(a, 128, 255, cv.THRESH_BINARY + cv.THRESH_OTSU, dst=b)
+        else:
+            cv.threshold(a, self.threshold, 255, cv.THRESH_BINARY, dst=b)
+
+        cv.dilate(b, self.dilateElement, dst=a)
+        cv.erode(a, self.erodeElement, dst=b)
+        cv.dilate(b, self.dilateElement, dst=a)
+
+        return a
@@ -0,0 +1,272 @@
+'''
+Live tracking from a camera or stream, for closed-loop experiments:
+
+    python live.py 0 --rois rois.json --budget 30 --csv live.csv
+
+A grabber thread reads frames as fast as the camera delivers them and keeps only the newest one, stamped with
+the time it was captured. The tracker always works on the newest frame, so when tracking falls behind the
+frames it could not get to are dropped instead of piling up, and every sample is at most one frame old.
+Frames that are already older than the latency budget (ms) when the tracker gets to them are dropped too.
+
+The current zone and position of each animal can be read at any time (LiveTracker.latest, .zone, .position),
+or handed to a callback as soon as each frame is tracked. A video file is played back at real time speed
+(--realtime, the default for files), dropping frames the same way a camera would, so a rig can be tested
+without one.
+'''
+
+import argparse
+import csv
+import cv2 as cv
+import threading
+import time
+from overlay import drawFrame
+from profiling import Profile
+from selectROIs import loadROIs
+from tracker import Tracker, PROTOCOLS
+from trajectory import TrajectoryWriter
+
+
+class FrameGrabber:
+    # Reads frames from a VideoCapture on its own thread, keeping only the newest (index, capture time, frame).
+    # With realtime=True a file is read at its own frame rate, as a camera would deliver it.
+    def __init__(self, source, realtime=False):
+        self.video = cv.VideoCapture(source)
+        if not self.video.isOpened():
+            raise IOError(f"Could not open video source: {source}")
+        # Don't let the driver queue up old frames
+        self.video.set(cv.CAP_PROP_BUFFERSIZE, 1)
+
+        self.fps = self.video.get(cv.CAP_PROP_FPS) or 30.0
+        self.frameSize = (int(self.video.get(cv.CAP_PROP_FRAME_WIDTH)),
+                          int(self.video.get(cv.CAP_PROP_FRAME_HEIGHT)))
+        self.realtime = realtime
+        self.start = None
+
+        self.frame = None
+        self.ended = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        index = 0
+        self.start = time.perf_counter()
+        while not self.ended:
+            if self.realtime:
+                # Wait until the frame would have been captured
+                delay = self.start + index / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if not self.video.grab():
+                break
+            captured = time.perf_counter() - self.start
+            ret, frame = self.video.retrieve()
+            if not ret:
+                break
+
+            with self.condition:
+                self.frame = (index, captured, frame)
+                self.condition.notify()
+            index += 1
+
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+
+    def next(self, last):
+        # Block until there is a frame newer than index `last`; None once the source has ended
+        with self.condition:
+            while not self.ended and (self.frame is None or self.frame[0] <= last):
+                self.condition.wait()
+            if self.frame is None or self.frame[0] <= last:
+                return None
+
+            return self.frame
+
+    def now(self):
+        # Seconds since the first frame was grabbed, on the clock frames are stamped with
+        return time.perf_counter() - self.start
+
+    def stop(self):
+        self.ended = True
+        self.thread.join()
+        self.video.release()
+
+
+class LiveTracker:
+    # Tracks the newest frame of a FrameGrabber until stopped, dropping frames it can't keep up with.
+    # onSamples(samples) is called from the tracking thread as soon as each frame is tracked.
+    def __init__(self, grabber, ROIs, protocol='OFT', budget=0.05, onSamples=None, **options):
+        self.grabber = grabber
+        self.tracker = Tracker(ROIs, protocol, frameSize=grabber.frameSize, **options)
+        self.budget = budget
+        self.onSamples = onSamples
+
+        # Latency of every tracked frame (capture to result) and the time spent tracking it
+        self.profile = Profile()
+        self.tracked = 0
+        self.dropped = 0
+        self.late = 0
+
+        self.latest = None
+        self.frame = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.grabber.thread.start()
+        self.thread.start()
+
+    def run(self):
+        last = -1
+        while not self.stopped:
+            item = self.grabber.next(last)
+            if item is None:
+                break
+            index, captured, frame = item
+            # Frames the grabber replaced before we got to them were dropped
+            self.dropped += index - last - 1
+            last = index
+
+            started = self.grabber.now()
+            if started - captured > self.budget:
+                self.dropped += 1
+                continue
+
+            self.tracker.frameIndex = index
+            samples = self.tracker.apply(frame, captured)
+            done = self.grabber.now()
+
+            self.profile.add('track', done - started)
+            self.profile.add('latency', done - captured)
+            if done - captured > self.budget:
+                self.late += 1
+            self.tracked += 1
+
+            # One assignment, so readers on other threads always see a whole frame's samples
+            self.latest = samples
+            self.frame = (frame, samples)
+            if self.onSamples is not None:
+                self.onSamples(samples)
+
+        self.stopped = True
+
+    def position(self, roi=0):
+        # Latest (x, y) of the animal in an ROI (by index or label), or None before the first frame
+        sample = self.sample(roi)
+        return None if sample is None else (sample.x, sample.y)
+
+    def zone(self, roi=0):
+        sample = self.sample(roi)
+        return None if sample is None else sample.location
+
+    def sample(self, roi=0):
+        latest = self.latest
+        if latest is None:
+            return None
+        if not isinstance(roi, int):
+            roi = self.tracker.labels.index(roi)
+
+        return latest[roi]
+
+    def stop(self):
+        self.stopped = True
+        self.grabber.stop()
+        self.thread.join()
+        self.profile.stop()
+
+    def report(self):
+        print(f"tracked {self.tracked} frames, dropped {self.dropped}, {self.late} over the "
+              f"{self.budget * 1000:.0f}ms budget")
+        return self.profile.report('live')
+
+
+def trackLive(source, ROIs, protocol='OFT', csvPath=None, trajectoryPath=None, display=False, budget=0.05,
+              realtime=False, duration=None, onSamples=None, **options):
+    # Track a camera (or a file played back in real time) until it ends, `duration` seconds have passed, or a
+    # key is pressed in the preview window. Samples are timestamped with their capture time (seconds since the
+    # first frame). Returns the LiveTracker.
+    grabber = FrameGrabber(source, realtime)
+    rowFormat = PROTOCOLS[protocol]['row']
+    csvFile = open(csvPath, "w", newline='') if csvPath is not None else None
+    trajectory = None
+
+    def write(samples):
+        # Keep the frame number and capture time, since frames can be dropped
+        if csvFile is not None:
+            csvWriter.writerows([s.frame] + rowFormat(s) + [round(s.time, 4)] + extra(s) for s in samples)
+        if trajectory is not None:
+            trajectory.add(samples)
+        if onSamples is not None:
+            onSamples(samples)
+
+    live = LiveTracker(grabber, ROIs, protocol, budget, write, **options)
+    # With a motion model, say how sure the tracker is of each position (see motion.py)
+    predicting = live.tracker.motion is not None
+    extra = (lambda s: [s.confidence]) if predicting else (lambda s: [])
+    if csvFile is not None:
+        csvWriter = csv.writer(csvFile)
+        csvWriter.writerow(['frame'] + PROTOCOLS[protocol]['header'] + ['time'] + ['confidence'] * predicting)
+    if trajectoryPath is not None:
+        trajectory = TrajectoryWriter(trajectoryPath, live.tracker, grabber.fps)
+
+    live.start()
+    try:
+        shown = None
+        while not live.stopped and (duration is None or grabber.start is None or grabber.now() < duration):
+            if display and live.frame is not None and live.frame is not shown:
+                # Draw on a copy, on this thread, so the preview never holds up tracking
+                shown = live.frame
+                frame, samples = shown
+                cv.imshow("live", drawFrame(frame.copy(), live.tracker, samples))
+                if cv.waitKey(1) >= 0:
+                    break
+            else:
+                time.sleep(0.005)
+    finally:
+        live.stop()
+        if csvFile is not None:
+            csvFile.close()
+        if trajectory is not None:
+            trajectory.close()
+        if display:
+            cv.destroyAllWindows()
+
+    return live
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track animals live from a camera or stream.")
+    parser.add_argument('source', help='camera index (e.g. 0), stream URL, or a video file to play back')
+    parser.add_argument('--rois', required=True, help='JSON file of arena ROIs')
+    parser.add_argument('--protocol', default='OFT', choices=['OFT', 'SIT'])
+    parser.add_argument('--budget', type=float, default=50, help='latency budget per frame (ms)')
+    parser.add_argument('--csv', help='write the trajectory to this CSV')
+    parser.add_argument('--traj', help='write the trajectory to this .traj file')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--display', action='store_true', help='show the tracked frames')
+    parser.add_argument('--no-realtime', action='store_true',
+                        help='read a video file as fast as possible instead of at its frame rate')
+    parser.add_argument('--region', default='rois', choices=['frame', 'rois', 'bbox'])
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--predict', action='store_true',
+                        help='search near each animal\'s predicted position, holding it when lost')
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    realtime = isinstance(source, str) and '://' not in source and not args.no_realtime
+
+    printed = [0.0]
+
+    def printZones(samples):
+        # Show where each animal is, a few times a second
+        if samples[0].time - printed[0] >= 0.2:
+            printed[0] = samples[0].time
+            print('\r' + '  '.join(f"{s.roi}: {s.location or '-':<6} ({s.x:6.1f}, {s.y:6.1f})" for s in samples),
+                  end='', flush=True)
+
+    live = trackLive(source, loadROIs(args.rois), args.protocol, args.csv, args.traj, args.display,
+                     args.budget / 1000, realtime, args.duration, printZones, region=args.region, scale=args.scale,
+                     predict=args.predict)
+    print()
+    live.report()
@@ -0,0 +1,98 @@
+'''
+Motion-predictive tracking (the Tracker's predict option, --predict). Each ROI's animal is followed with a
+constant velocity Kalman filter: every frame its position is predicted from the last ones, and the largest blob
+is only looked for in a small window around the prediction. Most of the mask is never scanned, and blobs
+elsewhere in the arena (a hand, a reflection) are not picked up. When there is nothing in the window the whole
+ROI is searched; when there is nothing there either the animal is lost, and its last position is held instead
+of jumping to (0, 0).
+
+Positions are the filter's smoothed estimates, each with a confidence:
+    1.0  found in the window around the prediction
+    0.5  found only by searching the whole ROI (re-acquired, possibly after a jump)
+    0.0  lost; the position is the last one known and the area is 0
+'''
+
+import cv2 as cv
+import math
+import numpy as np
+from centroid import largestBlob
+
+
+FOUND = 1.0
+REACQUIRED = 0.5
+LOST = 0.0
+
+# Constant velocity model, one step per tracked frame: the state is (x, y, vx, vy)
+TRANSITION = np.array([[1, 0, 1, 0],
+                       [0, 1, 0, 1],
+                       [0, 0, 1, 0],
+                       [0, 0, 0, 1]], np.float32)
+
+
+class MotionFilter:
+    # Follows the animal in one ROI's crop of the mask, of size (w, h); positions are in the crop's pixels.
+    # processNoise is how far (px^2 per frame) the animal's motion may stray from a straight line, and
+    # measurementNoise the jitter of the blob centroids (px^2).
+    def __init__(self, size, processNoise=1.0, measurementNoise=2.0):
+        self.size = size
+        self.measurementNoise = measurementNoise
+        self.kalman = cv.KalmanFilter(4, 2)
+        self.kalman.transitionMatrix = TRANSITION.copy()
+        self.kalman.measurementMatrix = np.eye(2, 4, dtype=np.float32)
+        self.kalman.processNoiseCov = np.eye(4, dtype=np.float32) * processNoise
+        self.kalman.measurementNoiseCov = np.eye(2, dtype=np.float32) * measurementNoise
+
+        # Smallest half-width of the search window, and the radius of the last blob found
+        self.minRadius = max(4, min(size) // 16)
+        self.blobRadius = 0.0
+        self.position = None
+        self.lost = True
+
+    def reset(self, point):
+        # Start again from a point found anywhere in the ROI, not knowing which way the animal is going
+        self.kalman.statePost = np.array([[point[0]], [point[1]], [0], [0]], np.float32)
+        self.kalman.errorCovPost = np.diag([self.measurementNoise, self.measurementNoise,
+                                            self.minRadius ** 2, self.minRadius ** 2]).astype(np.float32)
+
+    def window(self, centre):
+        # Part of the crop (x, y, w, h) to search around the predicted centre: the last blob's size plus three
+        # standard deviations of the prediction, so the whole blob is in it
+        sigma = math.sqrt(max(self.kalman.errorCovPre[0, 0], self.kalman.errorCovPre[1, 1]))
+        r = int(math.ceil(max(self.minRadius, 2 * self.blobRadius + 3 * sigma)))
+        w, h = self.size
+        x0, y0 = max(0, int(centre[0]) - r), max(0, int(centre[1]) - r)
+        x1, y1 = min(w, int(centre[0]) + r + 1), min(h, int(centre[1]) + r + 1)
+
+        return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+    def locate(self, mask, method='contours'):
+        # Position, blob area and confidence of the animal in this frame's crop of the mask. Before the animal
+        # has ever been found the position is (0, 0), as with largestBlob.
+        if self.position is not None:
+            predicted = self.kalman.predict()[:2, 0]
+
+        if not self.lost:
+            x, y, w, h = self.window(predicted)
+            (px, py), area = largestBlob(mask[y:y+h, x:x+w], method) if w and h else ((0, 0), 0)
+            if area:
+                self.blobRadius = math.sqrt(area / math.pi)
+                state = self.kalman.correct(np.array([[px + x], [py + y]], np.float32))
+                self.position = (float(state[0, 0]), float(state[1, 0]))
+                return self.position, area, FOUND
+
+        # Nothing near the prediction (or nothing to predict from), so look in the whole ROI
+        (px, py), area = largestBlob(mask, method)
+        if area:
+            self.blobRadius = math.sqrt(area / math.pi)
+            self.reset((px, py))
+            self.position = (px, py)
+            self.lost = False
+            return self.position, area, REACQUIRED
+
+        if self.position is None:
+            return (0, 0), 0, LOST
+
+        # Lost: hold the last position, and stop extrapolating from the old velocity
+        self.reset(self.position)
+        self.lost = True
+        return self.position, 0, LOST
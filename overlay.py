@@ -0,0 +1,73 @@
+import cv2 as cv
+import numpy as np
+from zones import shapeOutline, shapeBounds
+
+
+# Colour of each zone and of the centroid drawn inside it (BGR)
+ZONE_COLOURS = {'center': (0, 0, 255), 'Left': (0, 0, 255), 'Center': (0, 255, 0), 'Right': (255, 0, 0)}
+GREEN = (0, 255, 0)
+
+
+def framePoint(tracker, point):
+    # Position on the video frame of a point in tracker coordinates (which are lens corrected when the
+    # tracker has a calibration)
+    if tracker.lens is not None:
+        point = tracker.lens.distort([point])[0]
+
+    return (int(point[0]), int(point[1]))
+
+
+def drawZone(frame, tracker, shape, colour):
+    if tracker.lens is None and isinstance(shape, tuple):
+        x, y, w, h = shape
+        cv.rectangle(frame, (x, y), (x+w, y+h), colour, 2)
+        return
+
+    # Straight edges in corrected coordinates are curved on the distorted frame
+    outline = shapeOutline(shape)
+    if tracker.lens is not None:
+        outline = tracker.lens.distort(outline)
+    cv.polylines(frame, [np.int32(np.round(outline))], True, colour, 2)
+
+
+def drawOFT(frame, tracker, samples):
+    for sample in samples:
+        i = tracker.labels.index(sample.roi)
+
+        # Draw the ROI
+        x, y, w, h = tracker.ROIs[i]
+        cv.rectangle(frame, (x, y), (x+w, y+h), GREEN, 2)
+        cv.putText(frame, sample.roi, (x, y-10), cv.FONT_HERSHEY_SIMPLEX, 0.9, GREEN, 2)
+
+        # Draw middle zone in the ROI
+        for name, shape in tracker.zones[i]:
+            drawZone(frame, tracker, shape, ZONE_COLOURS.get(name, GREEN))
+
+        # Draw the centroid of the tracked object, red when it is in the center
+        colour = ZONE_COLOURS.get(sample.location, GREEN)
+        cv.circle(frame, framePoint(tracker, (sample.x, sample.y)), 5, colour, -1)
+
+
+def drawSIT(frame, tracker, samples):
+    for sample in samples:
+        i = tracker.labels.index(sample.roi)
+
+        # Draw each chamber in a different colour
+        y = tracker.arenas[i][1]
+        for name, shape in tracker.zones[i]:
+            colour = ZONE_COLOURS.get(name, GREEN)
+            drawZone(frame, tracker, shape, colour)
+            cv.putText(frame, name, framePoint(tracker, (shapeBounds(shape)[0], y-10)), cv.FONT_HERSHEY_SIMPLEX,
+                       0.9, colour, 2)
+
+        # Draw the centroid of the tracked object on the frame
+        cv.circle(frame, framePoint(tracker, (sample.x, sample.y)), 5, GREEN, -1)
+
+
+def drawFrame(frame, tracker, samples):
+    if tracker.protocol == 'SIT':
+        drawSIT(frame, tracker, samples)
+    else:
+        drawOFT(frame, tracker, samples)
+
+    return frame
@@ -0,0 +1,129 @@
+'''
+Staged version of the tracking loop. A decoder thread reads frames, the calling thread tracks them, and a
+writer thread draws, encodes and writes the CSV rows. The stages are joined by bounded queues, so decoding
+and encoding overlap with the tracking (OpenCV releases the GIL while it works) while no more than
+2 * queueSize frames are ever held in memory.
+'''
+
+import cv2 as cv
+import queue
+import threading
+import time
+
+
+def frameTime(video):
+    # Timestamp, in seconds, of the frame that was just read
+    return video.get(cv.CAP_PROP_POS_MSEC) / 1000
+
+
+def readFrames(video, count=None, stride=1, profile=None):
+    # (frame, timestamp) of every stride-th of the remaining frames of a VideoCapture, or of the next `count`
+    # frames. The frames in between are grabbed but never decoded into images. Decoding is timed into
+    # profile, if given.
+    while count is None or count > 0:
+        if profile is not None:
+            start = time.perf_counter()
+        ret, frame = video.read()
+        if not ret:
+            break
+        timestamp = frameTime(video)
+
+        # Skip to the next frame to track, without going past the last of the `count` frames
+        skip = stride - 1
+        if count is not None:
+            count -= 1
+            skip = min(skip, count)
+        for _ in range(skip):
+            if not video.grab():
+                count = 0
+                break
+            if count is not None:
+                count -= 1
+        if profile is not None:
+            profile.lap('decode', start)
+
+        yield frame, timestamp
+
+
+def put(q, item, stop):
+    # Block until there is room in the queue, unless another stage has stopped the pipeline
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def get(q, stop):
+    # Block until an item arrives; None once the pipeline has stopped and the queue is drained
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return None
+
+
+def decodeFrames(video, frames, stop, errors, count=None, stride=1, profile=None):
+    try:
+        for item in readFrames(video, count, stride, profile):
+            if not put(frames, item, stop):
+                break
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        # Tell the tracking stage there are no more frames
+        put(frames, None, stop)
+
+
+def writeFrames(results, sink, stop, errors):
+    try:
+        while True:
+            item = get(results, stop)
+            if item is None:
+                break
+            sink(*item)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
+
+def runPipeline(video, tracker, sink, queueSize=16, count=None):
+    # Track every remaining frame of an opened VideoCapture (or the next `count` of them, every
+    # tracker.stride-th), handing each (frame, samples) to sink on the writer thread. Errors raised by any
+    # stage are re-raised here.
+    frames = queue.Queue(queueSize)
+    results = queue.Queue(queueSize)
+    stop = threading.Event()
+    errors = []
+
+    decoder = threading.Thread(target=decodeFrames, args=(video, frames, stop, errors, count, tracker.stride,
+                                                                tracker.profile), daemon=True)
+    writer = threading.Thread(target=writeFrames, args=(results, sink, stop, errors), daemon=True)
+    decoder.start()
+    writer.start()
+
+    try:
+        while True:
+            item = get(frames, stop)
+            if item is None:
+                break
+            frame, timestamp = item
+            if not put(results, (frame, tracker.apply(frame, timestamp)), stop):
+                break
+
+        # Tell the writer there are no more frames and let it finish
+        put(results, None, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        writer.join()
+        stop.set()
+        decoder.join()
+
+    if errors:
+        raise errors[0]
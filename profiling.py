@@ -0,0 +1,156 @@
+'''
+Opt-in timing of each stage of the tracking loop (see trackVideo's profile option). Every stage records how long
+it took on each frame, so the summary printed at the end of a video shows where the time goes: the mean, median
+(p50), 99th percentile and worst time per frame of each stage, and the peak memory. The full per-stage
+histograms can be saved as JSON.
+
+Times are counted into a fixed log-spaced histogram as they arrive, so a Profile stays the same size however
+long it runs (a live session, a recording of several hours). p50 and p99 are read off the histogram, to within
+about 5%; the mean, total and worst time are exact.
+
+On Linux the peak memory is the run's own: the kernel's peak resident set size is reset when the Profile is
+made. Elsewhere it is the peak of the whole process so far, and is labelled as such.
+
+When profiling is off nothing is timed; each stage only checks whether a Profile was given.
+'''
+
+import json
+import math
+import numpy as np
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+# Order stages are reported in
+STAGES = ['decode', 'background', 'mask', 'centroid', 'classify', 'write', 'draw', 'encode']
+
+# Histogram bin edges, in seconds: 4 per decade from 10us to 10s
+BINS = np.logspace(-5, 1, 25)
+
+# Bins per decade times are counted into (a multiple of BINS' 4), over the same range, so the percentiles are
+# finer than the saved histogram
+FINE = 48
+FINE_BINS = np.logspace(-5, 1, 6 * FINE + 1)
+
+
+def resetPeakMemory():
+    # Start the peak resident set size again from the current one; False where it can't be (only Linux can)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def peakMemory(sinceReset=False):
+    # Largest resident set size in MB, since resetPeakMemory or of the whole process so far (None where it
+    # can't be read)
+    if sinceReset:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimes:
+    # Count, total, fastest and slowest of one stage's times, and how many fell in each of FINE_BINS (with a bin
+    # below them and one above)
+    def __init__(self):
+        self.counts = np.zeros(len(FINE_BINS) + 1, np.int64)
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds):
+        k = int((math.log10(seconds) + 5) * FINE) + 1 if seconds > 0 else 0
+        self.counts[min(max(k, 0), len(FINE_BINS))] += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        # Geometric middle of the bin the q-th percentile falls in, kept within the fastest and slowest times
+        k = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.counts.sum()))
+        if k == 0 or k > len(FINE_BINS) - 1:
+            return self.min if k == 0 else self.max
+        return min(max(math.sqrt(FINE_BINS[k - 1] * FINE_BINS[k]), self.min), self.max)
+
+    def histogram(self):
+        # Counts in each of BINS
+        return self.counts[1:len(FINE_BINS)].reshape(len(BINS) - 1, -1).sum(axis=1)
+
+
+class Profile:
+    def __init__(self):
+        self.times = {}
+        self.lock = threading.Lock()
+        # Whether the peak memory is this run's, rather than the process's
+        self.ownPeak = resetPeakMemory()
+        self.start = time.perf_counter()
+        self.wall = None
+
+    def lap(self, stage, start):
+        # Record the time since start against the stage; returns the current time, to start the next lap
+        now = time.perf_counter()
+        self.add(stage, now - start)
+
+        return now
+
+    def add(self, stage, seconds):
+        # The pipeline's threads all record into one Profile
+        with self.lock:
+            if stage not in self.times:
+                self.times[stage] = StageTimes()
+            self.times[stage].add(seconds)
+
+    def stop(self):
+        self.wall = time.perf_counter() - self.start
+
+    def summary(self):
+        stages = [s for s in STAGES if s in self.times] + sorted(s for s in self.times if s not in STAGES)
+        wall = self.wall if self.wall is not None else time.perf_counter() - self.start
+        summary = {'wall_seconds': wall, 'peak_memory_mb': peakMemory(self.ownPeak),
+                   'peak_memory_scope': 'run' if self.ownPeak else 'process', 'stages': {}}
+        for stage in stages:
+            t = self.times[stage]
+            frames = int(t.counts.sum())
+            summary['stages'][stage] = {
+                'frames': frames, 'total_seconds': t.total, 'mean_ms': t.total / frames * 1000,
+                'p50_ms': t.percentile(50) * 1000, 'p99_ms': t.percentile(99) * 1000, 'max_ms': t.max * 1000,
+                'histogram': {'edges_s': BINS.tolist(), 'counts': t.histogram().tolist()},
+            }
+
+        return summary
+
+    def report(self, name=''):
+        summary = self.summary()
+        memory = summary['peak_memory_mb']
+        label = 'peak memory' if self.ownPeak else 'process peak memory'
+        print(f"profile {name}: {summary['wall_seconds']:.2f}s"
+              + (f", {label} {memory:.0f} MB" if memory is not None else ""))
+        print(f"    {'stage':<12} {'frames':>7} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+              f"{'total s':>8} {'% wall':>7}")
+        for stage, s in summary['stages'].items():
+            print(f"    {stage:<12} {s['frames']:>7} {s['mean_ms']:>8.3f} {s['p50_ms']:>8.3f} {s['p99_ms']:>8.3f} "
+                  f"{s['max_ms']:>8.2f} {s['total_seconds']:>8.2f} "
+                  f"{s['total_seconds'] / summary['wall_seconds']:>7.1%}")
+
+        return summary
+
+    def save(self, path, **info):
+        with open(path, 'w') as f:
+            json.dump({**info, **self.summary()}, f, indent=4)
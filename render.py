@@ -0,0 +1,141 @@
+'''
+Draws the tracking onto a video after the fact, from the video and the trajectory it was tracked into, so
+tracking itself never has to draw or encode frames (see --no-video):
+
+    python render.py video.mp4 centroid_video.traj --stride 4 --scale 0.5 --start 60 --end 120
+
+Only the frames that are rendered are decoded; the ones in between a --stride are skipped with grab(). The
+output plays at real time speed, so a stride of 4 gives a quarter of the frame rate. A CSV trajectory also
+works, given the ROIs it was tracked with (--rois), and its zones if they weren't the protocol's (--zones).
+'''
+
+import argparse
+import cv2 as cv
+import numpy as np
+import os
+import pandas as pd
+from overlay import drawFrame
+from selectROIs import loadROIs
+from tracker import Tracker, Sample, skipFrames
+from trajectory import loadTrajectory, loadHeader, NO_ZONE
+from zones import loadZones, parseZones
+
+
+def loadSamples(path, labels=None):
+    # The trajectory as arrays of frame, ROI label, zone, x and y, sorted by frame, plus the header of a
+    # .traj file (None for a CSV)
+    if path.endswith('.traj'):
+        records, header = loadTrajectory(path)
+        zones = np.array(header['zones'] + [None] * (NO_ZONE + 1 - len(header['zones'])), dtype=object)
+        order = np.argsort(records['frame'], kind='stable')
+        records = records[order]
+
+        return (records['frame'].astype(np.int64), np.array(header['rois'], dtype=object)[records['roi']],
+                zones[records['zone']], records['x'], records['y']), header
+
+    # ROI labels are strings, even when they are numbers (3 or more arenas)
+    df = pd.read_csv(path, dtype={'rectangle': str})
+    # Rows are written a frame at a time, one per ROI
+    if 'rectangle' not in df.columns:
+        df['rectangle'] = [labels[i % len(labels)] for i in range(len(df))]
+    if 'frame' not in df.columns:
+        df['frame'] = df.groupby('rectangle', sort=False).cumcount()
+    df = df.sort_values('frame', kind='stable')
+
+    return (df['frame'].to_numpy(np.int64), df['rectangle'].to_numpy(object), df['location'].to_numpy(object),
+            df['x'].to_numpy(), df['y'].to_numpy()), None
+
+
+def renderVideo(videoPath, trajectoryPath, outputPath, ROIs=None, protocol=None, calibration=None, stride=1,
+                scale=1.0, start=None, end=None, codec='mp4v', zones=None):
+    # Write the frames of videoPath between start and end (seconds), every stride-th one, scaled by scale,
+    # with the tracked positions drawn on. Returns the number of frames written.
+    video = cv.VideoCapture(videoPath)
+    if not video.isOpened():
+        raise IOError(f"Could not open input video: {videoPath}")
+
+    totalFrames = int(video.get(cv.CAP_PROP_FRAME_COUNT))
+    frameRate = video.get(cv.CAP_PROP_FPS)
+    frameSize = (int(video.get(cv.CAP_PROP_FRAME_WIDTH)), int(video.get(cv.CAP_PROP_FRAME_HEIGHT)))
+
+    # The arena geometry and zones to draw come from the .traj header unless they are given
+    header = loadHeader(trajectoryPath) if trajectoryPath.endswith('.traj') else None
+    if ROIs is None:
+        if header is None or 'frame_rois' not in header:
+            video.release()
+            raise ValueError("The ROIs are needed to render this trajectory (--rois)")
+        ROIs = header['frame_rois']
+    if zones is None and header is not None and 'zone_shapes' in header:
+        zones = parseZones(header['zone_shapes'])
+    protocol = protocol or (header['protocol'] if header is not None else 'OFT')
+    tracker = Tracker(ROIs, protocol, header['rois'] if header is not None else None, calibration=calibration,
+                      frameSize=frameSize, zones=zones)
+
+    (frames, rois, locations, xs, ys), _ = loadSamples(trajectoryPath, tracker.labels)
+
+    first = int((start or 0) * frameRate)
+    last = min(totalFrames, int(end * frameRate)) if end is not None else totalFrames
+    outputSize = (int(round(frameSize[0] * scale)), int(round(frameSize[1] * scale)))
+    fourcc = cv.VideoWriter_fourcc(*codec)
+    output = cv.VideoWriter(outputPath, fourcc, frameRate / stride, outputSize)
+    if not output.isOpened():
+        video.release()
+        raise IOError(f"Error creating video writer: {outputPath}")
+
+    written = 0
+    try:
+        if not skipFrames(video, first):
+            return 0
+
+        for index in range(first, last, stride):
+            ret, frame = video.read()
+            if not ret:
+                break
+
+            # Samples of this frame
+            lo, hi = np.searchsorted(frames, [index, index + 1])
+            samples = [Sample(index, rois[k], locations[k], xs[k], ys[k]) for k in range(lo, hi)]
+            drawFrame(frame, tracker, samples)
+
+            if scale != 1:
+                frame = cv.resize(frame, outputSize, interpolation=cv.INTER_AREA)
+            output.write(frame)
+            written += 1
+
+            if not skipFrames(video, min(stride, last - index) - 1):
+                break
+    finally:
+        video.release()
+        output.release()
+
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw a tracked trajectory onto its video.")
+    parser.add_argument('video', help='video the trajectory was tracked from')
+    parser.add_argument('trajectory', help='.traj (or CSV) trajectory')
+    parser.add_argument('--output', help='annotated video to write (default: tracked_<video>.mp4)')
+    parser.add_argument('--rois', help='JSON file of the ROIs tracked (only needed for a CSV)')
+    parser.add_argument('--protocol', choices=['OFT', 'SIT'], help='protocol tracked (only needed for a CSV)')
+    parser.add_argument('--zones', help='JSON file of the zones tracked (only needed for a CSV tracked with --zones)')
+    parser.add_argument('--calibration', help='lens calibration the video was tracked with')
+    parser.add_argument('--stride', type=int, default=1, help='render every n-th frame')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the output relative to the video')
+    parser.add_argument('--start', type=float, help='first second of the video to render')
+    parser.add_argument('--end', type=float, help='last second of the video to render')
+    parser.add_argument('--codec', default='H264', help='fourcc of the output video')
+    args = parser.parse_args()
+
+    base_name = os.path.basename(args.video).split('.')[0]
+    outputPath = args.output or os.path.join(os.path.dirname(args.video), f"tracked_{base_name}.mp4")
+    try:
+        frames = renderVideo(args.video, args.trajectory, outputPath,
+                             loadROIs(args.rois) if args.rois is not None else None, args.protocol,
+                             args.calibration, args.stride, args.scale, args.start, args.end, args.codec,
+                             loadZones(args.zones) if args.zones is not None else None)
+    except (IOError, ValueError) as e:
+        print(f"ERROR: {e}")
+        exit()
+
+    print(f"rendered {frames} frames to {outputPath}")
@@ -1,4 +1,5 @@
 import cv2 as cv
+import json
 
 
 def selectROIs(frame, numROIs):
@@ -11,4 +12,17 @@ def selectROIs(frame, numROIs):
         cv.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
         cv.putText(frame, str(i + 1), (x, y-10), cv.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
-    return ROIs
\ No newline at end of file
+    return ROIs
+
+def saveROIs(path, ROIs):
+    # Store the selected arenas so later runs can skip selectROIs
+    with open(path, "w") as f:
+        json.dump({"rois": [[int(v) for v in roi] for roi in ROIs]}, f, indent=4)
+
+
+def loadROIs(path):
+    # Read arenas from a JSON config of the form {"rois": [[x, y, w, h], ...]}
+    with open(path) as f:
+        config = json.load(f)
+
+    return [tuple(int(v) for v in roi) for roi in config["rois"]]
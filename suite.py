@@ -0,0 +1,226 @@
+'''
+Speed and accuracy suite for the tracker, run on synthetic videos with a known ground truth (see synthetic.py),
+so a change to the mask processing, the centroid or the background model can be checked without real footage:
+
+    python suite.py --output suite_results
+    python suite.py --output suite_results --compare suite_results/suite_20230601-120000.json
+
+For each protocol (OFT with two arenas, SIT with one) the suite profiles every stage of the tracking loop
+(decode, background subtraction, mask filtering, centroid, zone classification, writing, drawing, encoding;
+see profiling.py), then tracks the video in each mode (see benchmark.MODES) and reports its frames/sec, the
+distance of its centroids from the true positions (median / 95th percentile / max, in pixels), how often the
+animal was found, and how often it was put in the right zone. Frames with a hand in the arena are scored
+separately. The videos are generated once and reused; every run's results are saved as JSON so they can be
+compared against later runs.
+'''
+
+import argparse
+import cv2 as cv
+import hashlib
+import json
+import numpy as np
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from benchmark import MODES, modeOptions
+from synthetic import makeVideo, loadTruth
+from tracker import Tracker, trackVideo, skipFrames
+from trajectory import loadTrajectory
+
+
+DEFAULT_MODES = ['serial', 'region=rois', 'scale=0.5', 'centroid=components', 'threshold=128', 'stride=2',
+                 'background=median', 'predict']
+
+# Frames at the start of each video while the background model learns the scene, left out of the scores
+WARMUP_FRAMES = 30
+
+# A run is flagged against the one it is compared with if it is this much slower, or less accurate
+SLOWER = 0.9
+WORSE_ERROR = 0.5
+WORSE_ZONES = 0.01
+
+
+def syntheticVideo(folder, protocol, frames, seed=0):
+    # Path of the synthetic video for a protocol, made the first time it is needed
+    path = os.path.join(folder, f"synthetic_{protocol}_{frames}_{seed}.mp4")
+    if not os.path.exists(f"{path}.truth.npz"):
+        print(f"generating {path}")
+        makeVideo(path, protocol, frames, seed=seed)
+
+    return path
+
+
+def stageTimes(video, ROIs, protocol, codec='mp4v'):
+    # Mean, p50 and p99 time per frame (ms) of each stage of the serial tracking loop, with the default tracker
+    # settings, writing the CSV and the annotated video
+    with tempfile.TemporaryDirectory() as tmp:
+        profilePath = os.path.join(tmp, 'profile.json')
+        trackVideo(video, ROIs, protocol, csvPath=os.path.join(tmp, 'centroid.csv'),
+                   videoPath=os.path.join(tmp, 'tracked.mp4'), codec=codec, profilePath=profilePath)
+        with open(profilePath) as f:
+            stages = json.load(f)['stages']
+
+    return {stage: {k: s[k] for k in ('mean_ms', 'p50_ms', 'p99_ms')} for stage, s in stages.items()}
+
+
+def checkFrameNumbers(video, ROIs, protocol, windows=((90, 10, 3), (90, 271, 3), (0, 25, 4), (5, 7, 2))):
+    # Track trial windows (first frame, frame count, stride) of a video, and check that every tracked image is
+    # the frame its samples are numbered with, by comparing it with every frame decoded in order
+    capture = cv.VideoCapture(video)
+    digests = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        digests.append(hashlib.sha1(frame).digest())
+    capture.release()
+
+    for first, count, stride in windows:
+        tracker = Tracker(ROIs, protocol, stride=stride)
+        capture = cv.VideoCapture(video)
+        skipFrames(capture, first)
+        tracker.frameIndex = first
+        numbers = []
+        for frame, samples in tracker.track(capture, count):
+            numbers.append(samples[0].frame)
+            if hashlib.sha1(frame).digest() != digests[samples[0].frame]:
+                raise AssertionError(f"frame {samples[0].frame} of {video} (first {first}, count {count}, stride "
+                                     f"{stride}) is not the image that was tracked")
+        capture.release()
+        if numbers != list(range(first, min(first + count, len(digests)), stride)):
+            raise AssertionError(f"tracked frames {numbers} of {video} (first {first}, count {count}, stride "
+                                 f"{stride}) are not every stride-th frame of the window")
+
+
+def trueZones(tracker, truth):
+    # Zone of the true position in every frame, for each ROI
+    zones = np.empty(truth['x'].shape, object)
+    for i in range(len(tracker.ROIs)):
+        for frame in range(len(zones)):
+            zones[frame, i] = tracker.classify(i, (truth['x'][frame, i], truth['y'][frame, i]))
+
+    return zones
+
+
+def score(trajectoryPath, truth, zones):
+    # Compare a tracked .traj with the ground truth, leaving out the warm-up frames. Frames with a hand in
+    # the arena are scored on their own.
+    records, header = loadTrajectory(trajectoryPath)
+    records = records[records['frame'] >= WARMUP_FRAMES]
+    frame, roi = records['frame'].astype(int), records['roi'].astype(int)
+    error = np.hypot(records['x'] - truth['x'][frame, roi], records['y'] - truth['y'][frame, roi])
+    zoneNames = np.array(header['zones'] + [None], dtype=object)
+    correct = zoneNames[np.minimum(records['zone'], len(header['zones']))] == zones[frame, roi]
+    found = records['area'] > 0
+    hand = truth['hand'][frame, roi]
+
+    def summary(keep):
+        if not keep.any():
+            return None
+        return {'error_median': float(np.median(error[keep])), 'error_p95': float(np.percentile(error[keep], 95)),
+                'error_max': float(error[keep].max()), 'found': float(found[keep].mean()),
+                'zone_accuracy': float(correct[keep].mean()), 'samples': int(keep.sum())}
+
+    return summary(~hand), summary(hand)
+
+
+def runSuite(folder, protocols, modes, frames, codec='mp4v'):
+    results = []
+    for protocol in protocols:
+        video = syntheticVideo(folder, protocol, frames)
+        truth = loadTruth(video)
+        ROIs = truth['rois']
+        zones = trueZones(Tracker(ROIs, protocol), truth)
+        checkFrameNumbers(video, ROIs, protocol)
+
+        print()
+        stages = stageTimes(video, ROIs, protocol, codec)
+
+        for label, options in [mode for mode in MODES if mode[0] in modes]:
+            with tempfile.TemporaryDirectory() as tmp:
+                trajectoryPath = os.path.join(tmp, 'centroid.traj')
+                options = modeOptions(options, video, tmp)
+                start = time.perf_counter()
+                tracked = trackVideo(video, ROIs, protocol, trajectoryPath=trajectoryPath, **options)
+                seconds = time.perf_counter() - start
+                accuracy, hand = score(trajectoryPath, truth, zones)
+
+            result = {'protocol': protocol, 'mode': label, 'frames': tracked, 'fps': tracked / max(seconds, 1e-9),
+                      'accuracy': accuracy, 'hand': hand}
+            if label == modes[0] or len(modes) == 1:
+                result['stages_ms'] = stages
+            results.append(result)
+            printResult(result)
+
+    return results
+
+
+def printResult(result, previous=None):
+    a = result['accuracy']
+    line = (f"{result['protocol']:<4} {result['mode']:<24} {result['fps']:>8.1f} fps   error median "
+            f"{a['error_median']:.2f}px p95 {a['error_p95']:.2f}px max {a['error_max']:.1f}px   found "
+            f"{a['found']:.1%}   zones {a['zone_accuracy']:.2%}")
+    if result['hand'] is not None:
+        line += f"   (hand: zones {result['hand']['zone_accuracy']:.1%})"
+    print(line)
+
+    if previous is not None:
+        p = previous['accuracy']
+        flags = []
+        if result['fps'] < previous['fps'] * SLOWER:
+            flags.append('SLOWER')
+        if a['error_median'] > p['error_median'] + WORSE_ERROR:
+            flags.append('LESS ACCURATE')
+        if a['zone_accuracy'] < p['zone_accuracy'] - WORSE_ZONES:
+            flags.append('WORSE ZONES')
+        print(f"{'':<29} vs previous: {result['fps'] / previous['fps']:.2f}x speed, error median "
+              f"{a['error_median'] - p['error_median']:+.2f}px, zones {a['zone_accuracy'] - p['zone_accuracy']:+.2%}"
+              f"   {' '.join(flags)}")
+
+
+def compare(results, path):
+    # Print each result next to the same protocol and mode of a saved run
+    with open(path) as f:
+        previous = {(r['protocol'], r['mode']): r for r in json.load(f)['results']}
+
+    print(f"\ncompared with {path}:")
+    for result in results:
+        if (result['protocol'], result['mode']) in previous:
+            printResult(result, previous[(result['protocol'], result['mode'])])
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the speed and accuracy of the tracker on synthetic videos.")
+    parser.add_argument('--output', default='suite_results', help='folder for the videos and the results')
+    parser.add_argument('--protocols', nargs='+', default=['OFT', 'SIT'], choices=['OFT', 'SIT'])
+    parser.add_argument('--modes', nargs='+', default=DEFAULT_MODES,
+                        help='benchmark.py modes to run (the first also reports its stage timings)')
+    parser.add_argument('--frames', type=int, default=1800, help='length of each synthetic video')
+    parser.add_argument('--codec', default='mp4v', help='fourcc used when timing the encode stage')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    results = runSuite(args.output, args.protocols, args.modes, args.frames, args.codec)
+
+    path = os.path.join(args.output, f"suite_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump({'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': gitCommit(), 'opencv': cv.__version__,
+                   'machine': platform.platform(), 'cpus': os.cpu_count(), 'frames': args.frames,
+                   'results': results}, f, indent=4)
+    print(f"\nsaved {path}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
@@ -0,0 +1,155 @@
+'''
+Synthetic arena videos with a known ground truth, for measuring the speed and accuracy of the tracker without
+real footage (see suite.py). A dark "mouse" wanders each arena on a smooth random path over a textured floor,
+with sensor noise, a slow drift in the lighting and, now and then, a hand reaching into an arena. The true
+position of every mouse in every frame is saved next to the video:
+
+    truth = makeVideo('synthetic_OFT.mp4', 'OFT', frames=900)
+    truth['x'][frame, roi], truth['y'][frame, roi], truth['hand'][frame, roi]
+'''
+
+import cv2 as cv
+import json
+import numpy as np
+
+
+# Colours (BGR) of the scene
+FLOOR = 185
+WALL = 70
+MOUSE = (45, 45, 50)
+HAND = (150, 175, 215)
+
+
+def layout(protocol, size, arenas=2):
+    # ROIs of the arenas in a frame of the given (w, h): square open fields in a grid (two side by side by
+    # default), or one three-chamber arena
+    w, h = size
+    if protocol == 'SIT':
+        aw, ah = int(w * 0.8), int(h * 0.4)
+        return [((w - aw) // 2, (h - ah) // 2, aw, ah)]
+
+    rows = max(1, int(round(np.sqrt(arenas * h / w))))
+    cols = int(np.ceil(arenas / rows))
+    side = int(min(w / cols, h / rows) * 0.8)
+    return [(int(w * (c + 0.5) / cols) - side // 2, int(h * (r + 0.5) / rows) - side // 2, side, side)
+            for r in range(rows) for c in range(cols)][:arenas]
+
+
+def randomPath(rng, roi, frames, fps, speed=0.25, margin=12):
+    # A smooth random walk inside the ROI: the heading wanders, the speed (arena widths / s) comes and goes
+    # as the mouse stops and starts, and it turns back at the walls
+    x, y, w, h = roi
+    position = np.array([x + w / 2, y + h / 2]) + rng.uniform(-0.3, 0.3, 2) * (w, h)
+    heading = rng.uniform(0, 2 * np.pi)
+    path = np.zeros((frames, 2))
+    for i in range(frames):
+        heading += rng.normal(0, 0.15)
+        moving = 0.5 + 0.5 * np.sin(2 * np.pi * i / (fps * 7) + heading / 3)
+        step = speed * min(w, h) / fps * moving * np.array([np.cos(heading), np.sin(heading)])
+        position += step
+
+        # Turn back at the walls
+        for k, (lo, hi) in enumerate([(x + margin, x + w - margin), (y + margin, y + h - margin)]):
+            if not lo <= position[k] <= hi:
+                position[k] = np.clip(position[k], lo, hi)
+                heading = np.pi - heading if k == 0 else -heading
+        path[i] = position
+
+    return path
+
+
+def background(rng, size, ROIs):
+    # Textured backdrop with a lighter, speckled floor and walls for each arena
+    w, h = size
+    frame = cv.GaussianBlur(rng.integers(60, 120, (h, w), dtype=np.uint8), (9, 9), 0)
+    for x, y, rw, rh in ROIs:
+        floor = cv.GaussianBlur(rng.integers(FLOOR - 20, FLOOR + 20, (rh, rw), dtype=np.uint8), (5, 5), 0)
+        frame[y:y+rh, x:x+rw] = floor
+        cv.rectangle(frame, (x, y), (x + rw, y + rh), WALL, 4)
+
+    return cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+
+
+def handIntrusions(rng, frames, fps, every=20.0):
+    # Frames during which a hand is in the arena: on average one visit every `every` seconds, each lasting
+    # 0.5-1.5s. Returns (first frame, length) of each visit.
+    visits = []
+    i = int(rng.exponential(every * fps))
+    while i < frames:
+        length = int(rng.uniform(0.5, 1.5) * fps)
+        visits.append((i, length))
+        i += length + int(rng.exponential(every * fps))
+
+    return visits
+
+
+def drawHand(frame, roi, progress, side):
+    # A hand reaching in from the top wall, furthest in halfway through the visit
+    x, y, w, h = roi
+    reach = int(h * 0.45 * np.sin(np.pi * progress))
+    cx = int(x + w * side)
+    points = np.array([[cx - 30, y - 10], [cx + 30, y - 10], [cx + 22, y + reach], [cx, y + reach + 14],
+                       [cx - 22, y + reach]], np.int32)
+    cv.fillPoly(frame, [points], HAND)
+
+
+def makeVideo(path, protocol='OFT', frames=900, fps=30.0, size=(960, 540), seed=0, codec='mp4v', noise=4.0,
+              drift=0.15, hands=True, arenas=2):
+    # Write a synthetic video of the protocol's arenas and save its ground truth to <path>.truth.npz.
+    # Returns the ground truth: the ROIs, and for every frame and ROI the mouse's x, y and whether a hand is
+    # in the arena.
+    rng = np.random.default_rng(seed)
+    ROIs = layout(protocol, size, arenas)
+    scene = background(rng, size, ROIs)
+    paths = [randomPath(rng, roi, frames, fps) for roi in ROIs]
+    visits = [handIntrusions(rng, frames, fps) if hands else [] for _ in ROIs]
+    mouseSize = max(4, min(size) // 45 if len(ROIs) <= 2 else ROIs[0][2] // 20)
+
+    output = cv.VideoWriter(path, cv.VideoWriter_fourcc(*codec), fps, size)
+    if not output.isOpened():
+        raise IOError(f"Error creating video writer: {path}")
+
+    # OpenCV's generator makes the noise much faster than numpy's
+    cv.setRNGSeed(seed)
+    grain = np.zeros(scene.shape, np.int16)
+
+    hand = np.zeros((frames, len(ROIs)), bool)
+    for i in range(frames):
+        frame = scene.copy()
+        for r, roi in enumerate(ROIs):
+            # The mouse is an ellipse pointing the way it is going
+            heading = paths[r][min(i + 1, frames - 1)] - paths[r][max(i - 1, 0)]
+            angle = np.degrees(np.arctan2(heading[1], heading[0]))
+            centre = (int(round(paths[r][i][0])), int(round(paths[r][i][1])))
+            cv.ellipse(frame, centre, (int(mouseSize * 1.6), mouseSize), angle, 0, 360, MOUSE, -1, cv.LINE_AA)
+
+            for first, length in visits[r]:
+                if first <= i < first + length:
+                    drawHand(frame, roi, (i - first) / length, 0.3 + 0.4 * ((first // length) % 2))
+                    hand[i, r] = True
+
+        # Lighting drifts slowly, and the sensor adds noise
+        gain = 1 + drift * np.sin(2 * np.pi * i / (fps * 60))
+        frame = cv.convertScaleAbs(frame, alpha=gain)
+        if noise:
+            cv.randn(grain, 0, noise)
+            frame = cv.add(frame, grain, dtype=cv.CV_8U)
+        output.write(frame)
+    output.release()
+
+    truth = {'protocol': protocol, 'rois': ROIs, 'fps': fps,
+             'x': np.stack([p[:, 0] for p in paths], 1), 'y': np.stack([p[:, 1] for p in paths], 1), 'hand': hand}
+    np.savez(f"{path}.truth.npz", protocol=protocol, rois=np.array(ROIs), fps=fps, x=truth['x'], y=truth['y'],
+             hand=hand, settings=json.dumps({'frames': frames, 'size': list(size), 'seed': seed, 'noise': noise,
+                                             'drift': drift, 'hands': hands, 'arenas': arenas}))
+
+    return truth
+
+
+def loadTruth(path):
+    # Ground truth saved by makeVideo for the video at path
+    data = np.load(f"{path}.truth.npz")
+
+    return {'protocol': str(data['protocol']), 'rois': [tuple(int(v) for v in roi) for roi in data['rois']],
+            'fps': float(data['fps']), 'x': data['x'], 'y': data['y'], 'hand': data['hand'],
+            'settings': json.loads(str(data['settings']))}
@@ -0,0 +1,631 @@
+'''
+Headless tracking engine shared by the OFT and SIT scripts. A Tracker owns the background subtractor for
+one video and, for every frame, runs background subtraction -> mask filtering -> centroid -> zone classification
+in each ROI. Nothing in here opens a window or waits on a key press, so it can run on machines without a
+display. Protocols (OFT, SIT) only differ in how an ROI is split into zones and how rows are written.
+'''
+
+import cv2 as cv
+import csv
+import numpy as np
+import os
+import time
+from collections import namedtuple
+from imageProcessing import MaskProcessor, scaledKernelSize
+from centroid import largestBlob
+from motion import MotionFilter
+from zones import ZoneMap
+from background import StaticBackground
+from overlay import drawFrame
+from pipeline import runPipeline, readFrames
+from trajectory import TrajectoryWriter
+from heatmap import OccupancyGrid, BINS
+from checkpoint import videoIdentity, loadCheckpoint, saveCheckpoint, truncateOutput
+from fisheye_correction import loadCalibration, PointCorrector
+from profiling import Profile
+
+
+# One tracked position, for one ROI, in one frame: the frame's index and timestamp (seconds), the ROI's
+# label, the zone the animal is in, its centroid and the area of its blob (full frame pixels), and how sure the
+# tracker is of the position (see motion.py; 0 when the animal was not found)
+Sample = namedtuple('Sample', ['frame', 'roi', 'location', 'x', 'y', 'time', 'area', 'confidence'],
+                    defaults=(float('nan'), 0.0, 1.0))
+
+
+def positionLabels(ROIs):
+    # With 2 arenas, name them by which side of the frame they are on
+    if len(ROIs) == 2:
+        if ROIs[0][0] - ROIs[1][0] < 0:
+            return ['LEFT', 'RIGHT']
+        return ['RIGHT', 'LEFT']
+
+    # Otherwise number them from left to right (ascending values of x)
+    order = sorted(range(len(ROIs)), key=lambda i: ROIs[i][0])
+    labels = [None] * len(ROIs)
+    for rank, i in enumerate(order):
+        labels[i] = str(rank + 1)
+
+    return labels
+
+
+def oftZones(roi):
+    # The center zone is a rectangle 2/3 the size of the arena, in the middle of it
+    x, y, w, h = roi
+    w_c = int(w * 2/3)
+    h_c = int(h * 2/3)
+    x_c = x + (w - w_c) // 2
+    y_c = y + (h - h_c) // 2
+
+    return [('center', (x_c, y_c, w_c, h_c))]
+
+
+def sitZones(roi):
+    # Split the arena into 3 equal chambers
+    x, y, w, h = roi
+    third = w // 3
+
+    return [('Left', (x, y, third, h)),
+            ('Center', (x + third, y, third, h)),
+            ('Right', (x + 2 * third, y, third, h))]
+
+
+# For each protocol: how an ROI is split into zones, the location given to a point outside every zone
+# (None keeps the last location), and the layout of the output CSV
+PROTOCOLS = {
+    'OFT': {
+        'zones': oftZones,
+        'outside': 'edge',
+        'header': ['rectangle', 'location', 'x', 'y'],
+        'row': lambda s: [s.roi, s.location, int(s.x), int(s.y)],
+    },
+    'SIT': {
+        'zones': sitZones,
+        'outside': None,
+        'header': ['location', 'x', 'y'],
+        'row': lambda s: [s.location, int(s.x), int(s.y)],
+    },
+}
+
+
+def boundingRect(ROIs):
+    # Smallest rectangle containing every ROI
+    x0 = min(x for x, y, w, h in ROIs)
+    y0 = min(y for x, y, w, h in ROIs)
+    x1 = max(x + w for x, y, w, h in ROIs)
+    y1 = max(y + h for x, y, w, h in ROIs)
+
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def correctedRect(lens, roi, steps=8):
+    # Bounding rectangle, in corrected coordinates, of a rectangle selected on the distorted frame
+    x, y, w, h = roi
+    t = np.linspace(0, 1, steps)
+    outline = np.concatenate([np.stack([x + w * t, np.full(steps, y)], 1),
+                              np.stack([x + w * t, np.full(steps, y + h)], 1),
+                              np.stack([np.full(steps, x), y + h * t], 1),
+                              np.stack([np.full(steps, x + w), y + h * t], 1)])
+    corrected = lens.undistort(outline)
+    x0, y0 = np.floor(corrected.min(axis=0))
+    x1, y1 = np.ceil(corrected.max(axis=0))
+
+    return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+
+def maskRegions(ROIs, region):
+    # The parts of the frame that get a background model and mask pipeline of their own:
+    #   'frame' - the whole frame (None), as the scripts always did
+    #   'rois'  - each ROI separately, so pixels outside the arenas are never modelled or filtered
+    #   'bbox'  - one region covering every ROI
+    # Returns the regions, and for each ROI the index of the region it is cut from.
+    if region == 'rois':
+        return list(ROIs), list(range(len(ROIs)))
+    if region == 'bbox':
+        return [boundingRect(ROIs)], [0] * len(ROIs)
+    if region == 'frame':
+        return [None], [0] * len(ROIs)
+
+    raise ValueError(f"Unknown mask region: {region}")
+
+
+class Tracker:
+    def __init__(self, ROIs, protocol='OFT', labels=None, history=2000, varThreshold=32.0,
+                 bShadowDetection=True, region='frame', scale=1.0, calibration=None, frameSize=None,
+                 centroidMethod='contours', threshold=None, stride=1, profile=None, zones=None, background=None,
+                 backgroundThreshold=25, predict=False):
+        self.ROIs = [tuple(int(v) for v in roi) for roi in ROIs]
+        self.protocol = protocol
+        self.labels = labels if labels is not None else positionLabels(self.ROIs)
+
+        # With a lens calibration (see fisheye_correction.py) the frames are tracked as they are, and only the
+        # centroids and the arena geometry are corrected, so zones and output are in corrected coordinates
+        self.lens = None
+        self.arenas = self.ROIs
+        if calibration is not None:
+            if isinstance(calibration, str):
+                calibration = loadCalibration(calibration)
+            self.lens = PointCorrector(calibration, frameSize)
+            self.arenas = [correctedRect(self.lens, roi) for roi in self.ROIs]
+        # Zones of each ROI, as (name, shape) (see zones.py); the protocol's rectangles unless given
+        if zones is None:
+            zones = [PROTOCOLS[protocol]['zones'](arena) for arena in self.arenas]
+        self.zones = [list(z) for z in zones]
+        if len(self.zones) != len(self.ROIs):
+            raise ValueError(f"Zones given for {len(self.zones)} ROIs, but there are {len(self.ROIs)}")
+        self.zoneMaps = [ZoneMap(z, arena) for z, arena in zip(self.zones, self.arenas)]
+        self.outside = PROTOCOLS[protocol]['outside']
+
+        # Every location a sample can be given, in a fixed order (used to store zones as small ints)
+        self.zoneNames = [] if self.outside is None else [self.outside]
+        for zones in self.zones:
+            self.zoneNames.extend(name for name, rect in zones if name not in self.zoneNames)
+
+        # Only every stride-th frame is tracked. The background model sees 1/stride as many frames, so its
+        # history is shortened to match, keeping the same learning rate per second of video.
+        self.stride = stride
+        history = max(1, int(round(history / stride)))
+
+        # One background subtractor per masked region of the frame: MOG2, or the region of a static background
+        # image (see background.py), cut out and scaled the same way as the frames will be
+        self.regions, self.roiRegion = maskRegions(self.ROIs, region)
+        if background is None:
+            self.bgSubtractors = [cv.createBackgroundSubtractorMOG2(history, varThreshold, bShadowDetection)
+                                  for _ in self.regions]
+        else:
+            if isinstance(background, str):
+                path, background = background, cv.imread(background)
+                if background is None:
+                    raise IOError(f"Could not read background image: {path}")
+            self.bgSubtractors = []
+            for r in self.regions:
+                image = background[r[1]:r[1]+r[3], r[0]:r[0]+r[2]] if r is not None else background
+                if scale != 1:
+                    image = cv.resize(image, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+                self.bgSubtractors.append(StaticBackground(image, backgroundThreshold))
+
+        # Masks can be made at a lower resolution than the frame; kernels shrink to match, and each ROI is
+        # cut out of its region's mask at the same scale
+        self.scale = scale
+        self.centroidMethod = centroidMethod
+        self.kernelSize = scaledKernelSize(scale)
+        self.processors = [MaskProcessor(self.kernelSize, threshold=threshold) for _ in self.regions]
+        self.crops = []
+        for (x, y, w, h), r in zip(self.ROIs, self.roiRegion):
+            rx, ry = self.regions[r][:2] if self.regions[r] is not None else (0, 0)
+            self.crops.append((int(round((x - rx) * scale)), int(round((y - ry) * scale)),
+                               max(1, int(round(w * scale))), max(1, int(round(h * scale)))))
+
+        # With predict=True each ROI's animal is followed with a motion model, and only looked for near where it
+        # is expected to be (see motion.py)
+        self.motion = None
+        if predict:
+            self.motion = [MotionFilter((cw, ch)) for cx, cy, cw, ch in self.crops]
+
+        # Buffers for each region's resized frame and raw foreground mask, reused from frame to frame
+        self.scaled = [None] * len(self.regions)
+        self.fgndMasks = [None] * len(self.regions)
+
+        self.lastLocation = [None] * len(self.ROIs)
+        self.frameIndex = 0
+
+        # Per-stage timings are recorded into this Profile (see profiling.py), if one is given
+        self.profile = profile
+
+    def zoneAt(self, i, point, last=None):
+        # Return the first zone of ROI i containing the point; outside every zone it is the protocol's
+        # outside location, or `last` if there is none
+        name = self.zoneMaps[i].name(point)
+        if name is not None:
+            return name
+
+        return self.outside if self.outside is not None else last
+
+    def classify(self, i, point):
+        location = self.zoneAt(i, point, self.lastLocation[i])
+        self.lastLocation[i] = location
+        return location
+
+    def masks(self, frame):
+        # Apply background subtractor to each region and denoise / smooth the mask. The masks returned are
+        # overwritten by the next call.
+        profile = self.profile
+        background = filtering = 0.0
+
+        processed = []
+        for r, region in enumerate(self.regions):
+            if profile is not None:
+                t0 = time.perf_counter()
+            if region is not None:
+                x, y, w, h = region
+                frame_region = frame[y:y+h, x:x+w]
+            else:
+                frame_region = frame
+            if self.scale != 1:
+                self.scaled[r] = cv.resize(frame_region, None, dst=self.scaled[r], fx=self.scale, fy=self.scale,
+                                           interpolation=cv.INTER_AREA)
+                frame_region = self.scaled[r]
+
+            self.fgndMasks[r] = self.bgSubtractors[r].apply(frame_region, self.fgndMasks[r])
+            if profile is not None:
+                t1 = time.perf_counter()
+                background += t1 - t0
+            processed.append(self.processors[r].apply(self.fgndMasks[r]))
+            if profile is not None:
+                filtering += time.perf_counter() - t1
+
+        if profile is not None:
+            profile.add('background', background)
+            profile.add('mask', filtering)
+
+        return processed
+
+    def apply(self, frame, timestamp=float('nan')):
+        processed = self.masks(frame)
+        profile = self.profile
+        blobs = classify = 0.0
+
+        samples = []
+        for i, (x, y, w, h) in enumerate(self.ROIs):
+            # Cut the ROI out of the mask of its region
+            region = self.regions[self.roiRegion[i]]
+            rx, ry = region[:2] if region is not None else (0, 0)
+            cx, cy, cw, ch = self.crops[i]
+            mask = processed[self.roiRegion[i]]
+
+            # Track the largest object in the ROI and convert back to whole frame coordinates
+            if profile is not None:
+                t0 = time.perf_counter()
+            confidence = None
+            if self.motion is not None:
+                (px, py), area, confidence = self.motion[i].locate(mask[cy:cy+ch, cx:cx+cw], self.centroidMethod)
+            else:
+                (px, py), area = largestBlob(mask[cy:cy+ch, cx:cx+cw], self.centroidMethod)
+            if confidence is None:
+                confidence = 1.0 if area else 0.0
+            if profile is not None:
+                t1 = time.perf_counter()
+                blobs += t1 - t0
+            if (px, py) != (0, 0):
+                # Map pixel centres of the scaled mask back to full resolution
+                px = (px + cx + 0.5) / self.scale - 0.5 - (x - rx)
+                py = (py + cy + 0.5) / self.scale - 0.5 - (y - ry)
+            point = (px + x, py + y)
+            if self.lens is not None:
+                point = tuple(self.lens.undistort([point])[0])
+            samples.append(Sample(self.frameIndex, self.labels[i], self.classify(i, point), point[0], point[1],
+                                  timestamp, area / self.scale ** 2, confidence))
+            if profile is not None:
+                classify += time.perf_counter() - t1
+
+        if profile is not None:
+            profile.add('centroid', blobs)
+            profile.add('classify', classify)
+
+        self.frameIndex += self.stride
+        return samples
+
+    def interpolate(self, previous, samples):
+        # Samples for the frames skipped between two tracked frames, moving in a straight line from the
+        # previous samples to these ones (zones are looked up at the interpolated points). Returns a list of
+        # samples per skipped frame.
+        skipped = []
+        for frame in range(previous[0].frame + 1, samples[0].frame):
+            t = (frame - previous[0].frame) / (samples[0].frame - previous[0].frame)
+            between = []
+            for i, (a, b) in enumerate(zip(previous, samples)):
+                if a.area and b.area:
+                    x, y = a.x + (b.x - a.x) * t, a.y + (b.y - a.y) * t
+                else:
+                    # No blob at one end, so there is no line to follow; take the nearer end instead, area and all
+                    # (an area of 0 says the position is only a placeholder)
+                    x, y = (a.x, a.y) if t < 0.5 else (b.x, b.y)
+                area = a.area + (b.area - a.area) * t if a.area and b.area else (a.area if t < 0.5 else b.area)
+                between.append(Sample(frame, a.roi, self.zoneAt(i, (x, y), a.location), x, y,
+                                      a.time + (b.time - a.time) * t, area, min(a.confidence, b.confidence)))
+            skipped.append(between)
+
+        return skipped
+
+    def hold(self, samples, end, fps):
+        # Samples for the frames after the last tracked one up to end (not included), holding its positions,
+        # so a stride still gives a sample for every frame. Returns a list of samples per frame.
+        return [[s._replace(frame=frame, time=s.time + (frame - s.frame) / fps if fps else s.time)
+                 for s in samples] for frame in range(samples[0].frame + 1, end)]
+
+    def coverage(self, processed):
+        # Foreground pixels of each ROI's mask in each of its zones, [outside, zone 1, ...], for the masks
+        # returned by masks(). Needs the masks to be in tracker coordinates, so not with a lens calibration.
+        if self.lens is not None:
+            raise ValueError("Zone coverage is not available with a lens calibration")
+
+        counts = []
+        for i, (x, y, w, h) in enumerate(self.ROIs):
+            cx, cy, cw, ch = self.crops[i]
+            mask = processed[self.roiRegion[i]][cy:cy+ch, cx:cx+cw]
+            counts.append(self.zoneMaps[i].coverage(mask, (x, y), self.scale))
+
+        return counts
+
+    def track(self, video, count=None):
+        # Stream (frame, samples) for every stride-th remaining frame of an opened VideoCapture, or of the
+        # next `count` frames
+        for frame, timestamp in readFrames(video, count, self.stride, self.profile):
+            yield frame, self.apply(frame, timestamp)
+
+
+def trialFrames(window, labels, frameRate, warmup=30.0):
+    # Frames to track for a trial window: either one (start, end) in seconds for every ROI, or a dict of
+    # ROI label -> (start, end). end may be None for the end of the video. Returns the frame to start
+    # tracking at (warmup seconds before the earliest start, so the background model has settled), the
+    # frame to stop before (None for the end of the video), and the [first, last) frames kept for each ROI.
+    if not isinstance(window, dict):
+        window = {label: window for label in labels}
+
+    kept = []
+    for label in labels:
+        start, end = window.get(label, (0, None))
+        kept.append((int((start or 0) * frameRate), None if end is None else int(end * frameRate)))
+
+    first = max(0, min(k[0] for k in kept) - int(warmup * frameRate))
+    ends = [k[1] for k in kept]
+    last = None if None in ends else max(ends)
+
+    return first, last, kept
+
+
+def skipFrames(video, count):
+    # Move past frames without decoding them into images; returns False if the video ends first
+    for _ in range(count):
+        if not video.grab():
+            return False
+
+    return True
+
+
+def trackVideo(file, ROIs, protocol='OFT', csvPath=None, videoPath=None, display=False, labels=None,
+               codec='H264', progress=None, progressEvery=500, pipelined=False, queueSize=16,
+               trajectoryPath=None, window=None, warmup=30.0, profile=False, profilePath=None, heatmapPath=None,
+               heatmapBins=BINS, checkpointPath=None, checkpointEvery=60.0, **options):
+    # Track a whole video file, writing the trajectory to csvPath and / or a binary trajectory file
+    # (trajectoryPath, see trajectory.py) and, optionally, the annotated frames to videoPath. Nothing is
+    # shown on screen unless display is True. progress(frames done, total frames) is called every
+    # progressEvery frames. With pipelined=True decoding, tracking and writing run as separate
+    # stages (see pipeline.py); the preview window is only available in the serial loop. With a trial window
+    # (see trialFrames) the frames before it are skipped, tracking starts warmup seconds early to train the
+    # background model, and decoding stops at its end; only samples inside each ROI's window are written,
+    # with the video frame number in the CSV. With profile=True the time each stage takes on every frame is
+    # recorded and summarised when the video is done (see profiling.py), and saved as JSON to profilePath if
+    # given. With predict=True (see motion.py) the CSV gets a confidence column. With heatmapPath, each ROI's
+    # occupancy grid is built up from the written samples and saved there once the run is done (see
+    # heatmap.py). With checkpointPath, progress is saved there every checkpointEvery seconds of video, and a
+    # stopped run is resumed from it (see checkpoint.py); a video whose checkpoint is complete is not tracked
+    # again. Any other options are passed on to the Tracker. Returns the number of frames written.
+    config = {'video': videoIdentity(file), 'rois': [list(roi) for roi in ROIs], 'protocol': protocol,
+              'labels': labels, 'window': window, 'warmup': warmup, 'options': {k: str(v) for k, v in options.items()},
+              'outputs': [csvPath, trajectoryPath, heatmapPath, heatmapBins]}
+    checkpoint = loadCheckpoint(checkpointPath, config)
+    if checkpoint is not None and checkpoint['complete'] and all(
+            os.path.exists(path) for path in (csvPath, trajectoryPath, heatmapPath) if path is not None):
+        print(f"already tracked {file}, skipping")
+        return checkpoint['written']
+    if checkpoint is not None and checkpoint['complete']:
+        # Done before, but an output has since been deleted
+        checkpoint = None
+
+    video = cv.VideoCapture(file)
+    if not video.isOpened():
+        raise IOError(f"Could not open input video: {file}")
+
+    # Get paramaters of input video
+    totalFrames = int(video.get(cv.CAP_PROP_FRAME_COUNT))
+    frameRate = video.get(cv.CAP_PROP_FPS)
+    frameSize = (int(video.get(cv.CAP_PROP_FRAME_WIDTH)), int(video.get(cv.CAP_PROP_FRAME_HEIGHT)))
+
+    profile = Profile() if profile or profilePath is not None else None
+    tracker = Tracker(ROIs, protocol, labels, frameSize=frameSize, profile=profile, **options)
+    header = PROTOCOLS[protocol]['header']
+    rowFormat = PROTOCOLS[protocol]['row']
+
+    if tracker.motion is not None:
+        # Say how sure the tracker is of each position; 0 means the animal was lost and its last position held
+        header = header + ['confidence']
+        rowFormat = lambda s, row=rowFormat: row(s) + [s.confidence]
+
+    first, last = 0, None
+    if window is not None:
+        first, last, kept = trialFrames(window, tracker.labels, frameRate, warmup)
+        kept = dict(zip(tracker.labels, kept))
+        totalFrames = min(totalFrames, last or totalFrames) - min(start for start, end in kept.values())
+
+        # Frame numbers no longer start at 0, so write them out for data_analysis.py
+        header = ['frame'] + header
+        rowFormat = lambda s, row=rowFormat: [s.frame] + row(s)
+
+    # Frames up to resumeAfter were written before the checkpoint. The background model is rebuilt by tracking
+    # from warmup seconds before it (a whole number of strides, so the same frames are tracked as before).
+    resumeAfter = -1
+    if checkpoint is not None:
+        resumeAfter = checkpoint['frame']
+        following = resumeAfter + tracker.stride
+        rebuild = 0 if options.get('background') is not None else int(warmup * frameRate)
+        first = following - min(-(-rebuild // tracker.stride), (following - first) // tracker.stride) * tracker.stride
+        print(f"resuming {file} after frame {resumeAfter}")
+
+    count = None if last is None else max(0, last - first)
+    if first > 0:
+        if not skipFrames(video, first):
+            video.release()
+            raise IOError(f"Tracking would start after the end of the video: {file}")
+        tracker.frameIndex = first
+
+    outputVid = None
+    if videoPath is not None and checkpoint is not None:
+        # A video file can't be appended to, so the rest of the annotated video goes in a file of its own
+        stem, ext = os.path.splitext(videoPath)
+        videoPath = f"{stem}_from{resumeAfter + 1}{ext}"
+    if videoPath is not None:
+        # Create a VideoWriter object and use size from input video
+        fourcc = cv.VideoWriter_fourcc(*codec)
+        # Only the tracked frames are written, so with a stride the video plays at real time speed
+        outputVid = cv.VideoWriter(videoPath, fourcc, frameRate / tracker.stride, frameSize)
+        if not outputVid.isOpened():
+            video.release()
+            raise IOError(f"Error creating video writer: {videoPath}")
+
+    # When resuming, anything written after the checkpoint is cut off and the outputs are appended to
+    if checkpoint is not None:
+        for path, size in checkpoint['outputs'].items():
+            truncateOutput(path, size)
+
+    csvFile = None
+    if csvPath is not None:
+        csvFile = open(csvPath, "a" if checkpoint is not None else "w", newline='')
+        csvWriter = csv.writer(csvFile)
+        if checkpoint is None:
+            csvWriter.writerow(header)
+
+    trajectory = None
+    if trajectoryPath is not None:
+        trajectory = TrajectoryWriter(trajectoryPath, tracker, frameRate, append=checkpoint is not None)
+    heatmap = OccupancyGrid(tracker, frameRate, heatmapBins) if heatmapPath is not None else None
+
+    written = [0]
+    previous = [None]
+    # Last tracked frame that was written, the frame of the last checkpoint, and whether a frame is being
+    # written (when the outputs don't line up with a frame boundary)
+    done = [resumeAfter]
+    saved = [resumeAfter]
+    writing = [False]
+    if checkpoint is not None:
+        written[0] = checkpoint['written']
+        if checkpoint['previous'] is not None:
+            previous[0] = [Sample(*values) for values in checkpoint['previous']]
+        if heatmap is not None:
+            heatmap.restore(checkpoint['heatmap'])
+
+    def saveProgress(complete=False):
+        # Save a checkpoint at the last frame written
+        outputs = {}
+        if csvFile is not None:
+            csvFile.flush()
+            outputs[csvPath] = csvFile.tell()
+        if trajectory is not None:
+            trajectory.flush()
+            outputs[trajectoryPath] = trajectory.file.tell()
+        saveCheckpoint(checkpointPath, {
+            'config': config, 'complete': complete, 'frame': done[0], 'written': written[0], 'outputs': outputs,
+            'previous': None if previous[0] is None else [list(s) for s in previous[0]],
+            'heatmap': heatmap.state() if heatmap is not None else None,
+        })
+        saved[0] = done[0]
+
+    def writeRows(rows):
+        # Write the samples of one or more frames to the outputs; returns False if none of them were kept
+        if window is not None:
+            # Frames in the warm-up, or outside every ROI's window, are tracked but not written
+            rows = [s for s in rows if kept[s.roi][0] <= s.frame and (kept[s.roi][1] is None
+                                                                      or s.frame < kept[s.roi][1])]
+            if not rows:
+                return False
+
+        if csvFile is not None:
+            csvWriter.writerows(rowFormat(s) for s in rows)
+        if trajectory is not None:
+            trajectory.add(rows)
+        if heatmap is not None:
+            heatmap.add(rows)
+
+        before = written[0]
+        written[0] += len({s.frame for s in rows})
+        if progress is not None and written[0] // progressEvery > before // progressEvery:
+            progress(written[0], totalFrames)
+
+        return True
+
+    def writeFrame(frame, samples):
+        # Everything that happens to a frame after it has been tracked. With a stride, rows for the frames
+        # skipped since the last tracked one are interpolated and written first.
+        if samples[0].frame <= resumeAfter:
+            # Rebuilding the background model before the checkpoint; those frames are already written
+            return
+
+        writing[0] = True
+        rows = samples
+        if tracker.stride > 1 and previous[0] is not None:
+            rows = [s for skipped in tracker.interpolate(previous[0], samples) for s in skipped] + samples
+        previous[0] = samples
+
+        if profile is not None:
+            start = time.perf_counter()
+        if not writeRows(rows):
+            done[0] = samples[0].frame
+            writing[0] = False
+            return
+        if profile is not None:
+            start = profile.lap('write', start)
+
+        if display or outputVid is not None:
+            drawFrame(frame, tracker, samples)
+            if profile is not None:
+                start = profile.lap('draw', start)
+
+        if outputVid is not None:
+            outputVid.write(frame)
+            if profile is not None:
+                profile.lap('encode', start)
+
+        done[0] = samples[0].frame
+        writing[0] = False
+        if checkpointPath is not None and done[0] - saved[0] >= checkpointEvery * frameRate:
+            saveProgress()
+
+    stopped = False
+    try:
+        if pipelined and not display:
+            runPipeline(video, tracker, writeFrame, queueSize, count)
+        else:
+            for frame, samples in tracker.track(video, count):
+                writeFrame(frame, samples)
+
+                if display:
+                    cv.imshow("frame", frame)
+                    if cv.waitKey(1) >= 0:
+                        stopped = True
+                        break
+
+        if not stopped and tracker.stride > 1 and previous[0] is not None:
+            # The frames after the last tracked one, up to the end of the video or trial, hold its positions
+            end = int(video.get(cv.CAP_PROP_POS_FRAMES))
+            writeRows([s for held in tracker.hold(previous[0], end, frameRate) for s in held])
+
+        # Only a whole run's heatmap is saved, so a partial one is never merged as a whole animal (a stopped run
+        # keeps its grids in its checkpoint, if it has one)
+        if heatmap is not None and not stopped:
+            heatmap.save(heatmapPath, file)
+        if checkpointPath is not None:
+            # Stopped by a key press, or done
+            saveProgress(complete=not stopped)
+    except KeyboardInterrupt:
+        # Keep what has been tracked, unless it was caught halfway through writing a frame (or on another thread)
+        if checkpointPath is not None and not writing[0] and not (pipelined and not display):
+            saveProgress()
+        raise
+    finally:
+        # Clean up
+        video.release()
+        if outputVid is not None:
+            outputVid.release()
+        if csvFile is not None:
+            csvFile.close()
+        if trajectory is not None:
+            trajectory.close()
+        if display:
+            cv.destroyAllWindows()
+
+    if profile is not None:
+        profile.stop()
+        profile.report(os.path.basename(file))
+        if profilePath is not None:
+            profile.save(profilePath, video=file, frames=written[0], options={k: str(v) for k, v in options.items()})
+
+    return written[0]
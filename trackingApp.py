@@ -0,0 +1,226 @@
+'''
+Front end shared by OFT.py, OFT_folder.py and SIT.py. Run with no arguments to get the parameter window and
+select arenas by hand, as before. Pass a video (or folder) and a ROI config on the command line with
+--headless to track without opening any windows, e.g. on a render node:
+
+    python OFT.py video.mp4 --rois rois.json --headless
+
+A ROI config can be written from a manual selection with --save-rois.
+'''
+
+import argparse
+import cv2 as cv
+import json
+import os
+from selectROIs import selectROIs, loadROIs, saveROIs
+from background import loadOrBuildBackground
+from tracker import trackVideo
+from zones import loadZones
+
+
+def parseArgs(description, folder=False):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('path', nargs='?',
+                        help='folder of .mp4 videos to track' if folder else 'video file to track')
+    parser.add_argument('--arenas', type=int, help='number of arenas to select by hand')
+    parser.add_argument('--rois', help='JSON file of arena ROIs, used instead of selecting them by hand')
+    parser.add_argument('--save-rois', help='write the hand selected ROIs to this JSON file')
+    parser.add_argument('--output-dir', help='where to write the output CSV and video')
+    parser.add_argument('--headless', action='store_true',
+                        help='make no GUI calls (requires a path and --rois)')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='decode, track and write on separate threads (no preview window)')
+    parser.add_argument('--region', default='frame', choices=['frame', 'rois', 'bbox'],
+                        help='run background subtraction on the whole frame, on each ROI, or on the '
+                             'bounding box of all ROIs')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='resolution to make the tracking masks at, relative to the video (e.g. 0.5)')
+    parser.add_argument('--calibration',
+                        help='lens calibration JSON from fisheye_correction.py; track the raw video and write '
+                             'lens-corrected coordinates')
+    parser.add_argument('--centroid-method', default='contours', choices=['contours', 'components'],
+                        help='find the largest blob from its contour, or with connected components')
+    parser.add_argument('--threshold', type=int,
+                        help='fixed threshold for the foreground mask instead of Otsu (e.g. 128)')
+    parser.add_argument('--no-video', action='store_true',
+                        help='write only the trajectory; draw the tracking onto the video later with render.py')
+    parser.add_argument('--zones',
+                        help='JSON file of zones (rectangles, circles or polygons) for each ROI, instead of the '
+                             "protocol's")
+    parser.add_argument('--background', default='mog2', choices=['mog2', 'median'],
+                        help='adaptive MOG2 background model, or a static median background built once from a '
+                             'sample of frames and shared by every video (for steady lighting)')
+    parser.add_argument('--background-image', help='use this image as the static background')
+    parser.add_argument('--background-frames', type=int, default=25,
+                        help='frames sampled to build the median background')
+    parser.add_argument('--background-threshold', type=int, default=25,
+                        help='grey level difference from the static background counted as foreground')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='track every n-th frame and interpolate the positions in between')
+    parser.add_argument('--predict', action='store_true',
+                        help='follow each animal with a motion model, search near its predicted position, and '
+                             'hold its last position with confidence 0 when it is lost')
+    parser.add_argument('--profile', action='store_true',
+                        help='time each stage of the tracking loop and print a summary for every video')
+    parser.add_argument('--profile-json', action='store_true',
+                        help='also save each profile, with its histograms, as profile_<video>.json')
+    parser.add_argument('--output-format', default='csv', choices=['csv', 'traj', 'both'],
+                        help='write the trajectory as CSV, as a compact binary .traj file, or both')
+    parser.add_argument('--heatmap', action='store_true',
+                        help='also save each ROI\'s occupancy and speed grids as heatmap_<video>.npz (see heatmap.py)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save progress to checkpoint_<video>.json, resume from it if the run is stopped, and '
+                             'skip videos that are already done (see checkpoint.py)')
+    parser.add_argument('--checkpoint-every', type=float, default=60,
+                        help='seconds of video between checkpoints')
+    parser.add_argument('--start', type=float, help='start of the trial (s); earlier frames are not tracked')
+    parser.add_argument('--end', type=float, help='end of the trial (s); decoding stops here')
+    parser.add_argument('--windows',
+                        help='JSON file of trial windows per ROI label, {"LEFT": [start, end], ...} (s), '
+                             'instead of --start / --end')
+    parser.add_argument('--warmup', type=float, default=30.0,
+                        help='seconds tracked before the trial to train the background model')
+    if folder:
+        parser.add_argument('--workers', type=int, default=1,
+                            help='number of videos to track in parallel (0 = one per core)')
+        parser.add_argument('--select-each', action='store_true',
+                            help='select arenas separately for every video, before tracking starts')
+
+    args = parser.parse_args()
+    if args.headless and (args.path is None or args.rois is None):
+        parser.error('--headless requires a path and --rois')
+
+    return args
+
+
+def trackerOptions(args):
+    # Tracker settings taken from the command line
+    return {'region': args.region, 'scale': args.scale, 'calibration': args.calibration,
+            'centroidMethod': args.centroid_method, 'threshold': args.threshold, 'stride': args.stride,
+            'predict': args.predict, 'zones': loadZones(args.zones) if args.zones is not None else None}
+
+
+def backgroundOptions(args, videos, cacheDir):
+    # The static background for these videos (built, or loaded from cacheDir), as Tracker options
+    if args.background_image is not None:
+        path = args.background_image
+    elif args.background == 'median':
+        path = loadOrBuildBackground(videos, cacheDir, args.background_frames)
+        print(f"using background {path}")
+    else:
+        return {}
+
+    return {'background': path, 'backgroundThreshold': args.background_threshold}
+
+
+def trialWindow(args):
+    # Trial window arguments for trackVideo, from --windows or --start / --end
+    window = None
+    if args.windows is not None:
+        with open(args.windows) as f:
+            window = {label: tuple(w) for label, w in json.load(f).items()}
+    elif args.start is not None or args.end is not None:
+        window = (args.start or 0, args.end)
+
+    return {'window': window, 'warmup': args.warmup}
+
+
+def outputPaths(args, folder, base_name):
+    # Trajectory (and profile, heatmap and checkpoint) files to write, as trackVideo arguments
+    paths = {'csvPath': None, 'trajectoryPath': None, 'profile': args.profile,
+             'profilePath': os.path.join(folder, f"profile_{base_name}.json") if args.profile_json else None,
+             'heatmapPath': os.path.join(folder, f"heatmap_{base_name}.npz") if args.heatmap else None,
+             'checkpointPath': os.path.join(folder, f"checkpoint_{base_name}.json") if args.checkpoint else None,
+             'checkpointEvery': args.checkpoint_every}
+    if args.output_format in ('csv', 'both'):
+        paths['csvPath'] = os.path.join(folder, f"centroid_{base_name}.csv")
+    if args.output_format in ('traj', 'both'):
+        paths['trajectoryPath'] = os.path.join(folder, f"centroid_{base_name}.traj")
+
+    return paths
+
+
+def parameterWindow(defaultArenas, folder=False):
+    # Only imported when a window is actually needed
+    import PySimpleGUI as sg
+
+    # Define the layout for the paramter window
+    browse = sg.FolderBrowse if folder else sg.FileBrowse
+    layout_params = [
+        [sg.Text('Select Video File: '), browse('Browse', key='-path-')],
+        [sg.Text('Number of Arenas: '), sg.InputText(default_text=str(defaultArenas), key='-numArenas-')],
+        [sg.Button('Start')]
+    ]
+
+    # Create the paramter setting window and read events from it
+    window_params = sg.Window('Parameter Settings', layout_params)
+    event, values = window_params.read()
+    window_params.close()
+
+    if event == sg.WINDOW_CLOSED:
+        return None
+
+    return values['-path-'], int(values['-numArenas-'])
+
+
+def firstFrame(file):
+    # Use the first frame of a video to select ROIs on
+    video = cv.VideoCapture(file)
+    ret, frame = video.read()
+    video.release()
+    if not ret:
+        raise IOError(f"Could not open input video: {file}")
+
+    return frame
+
+
+def getROIs(args, file, numROIs):
+    if args.rois is not None:
+        return loadROIs(args.rois)
+
+    ROIs = selectROIs(firstFrame(file), numROIs)
+    if args.save_rois is not None:
+        saveROIs(args.save_rois, ROIs)
+
+    return ROIs
+
+
+def getParameters(args, defaultArenas, folder=False):
+    # Take the path and number of arenas from the command line, or ask for them
+    if args.path is not None:
+        return args.path, args.arenas or defaultArenas
+
+    params = parameterWindow(args.arenas or defaultArenas, folder)
+    if params is None:
+        exit()
+
+    return params
+
+
+def baseName(file):
+    # Get the base file name
+    return os.path.basename(file).split('.')[0]
+
+
+def runProtocol(protocol, defaultArenas, description):
+    # Track a single video with the given protocol
+    args = parseArgs(description)
+    file, numROIs = getParameters(args, defaultArenas)
+    base_name = baseName(file)
+    output_dir = args.output_dir or '.'
+
+    try:
+        ROIs = getROIs(args, file, numROIs)
+        trackVideo(file, ROIs, protocol,
+                   **outputPaths(args, output_dir, base_name),
+                   videoPath=None if args.no_video else os.path.join(output_dir, f"tracked_{base_name}.mp4"),
+                   display=not (args.headless or args.pipelined),
+                   pipelined=args.pipelined,
+                   **trialWindow(args),
+                   **backgroundOptions(args, [file], output_dir),
+                   **trackerOptions(args))
+    except IOError as e:
+        print(f"ERROR: {e}")
+        exit()
+
+    print("finished tracking video")
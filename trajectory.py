@@ -0,0 +1,189 @@
+'''
+Compact binary trajectory files (.traj), written alongside or instead of the per-row CSV.
+
+A .traj file is a short JSON header followed by compressed blocks of frames. Each block holds its frames as
+columns: the frame numbers and timestamps once per frame, then for every ROI in turn a column each of x, y, area
+and zone:
+
+    frames (uint32), count of them
+    frame (uint32) and time (float32, s) of each frame
+    x, y (float32, px), area (float32, px^2) and zone (uint8) of each ROI in each frame, one ROI after another
+
+stored as the 4-byte length of the block, then the block compressed with zlib. The ROI labels and zone names
+are stored once in the header, and zones are indexes into them (255 means no zone yet, e.g. SIT before the
+first chamber is entered; 254 that the ROI wasn't written that frame, as outside its trial window). The file is
+only ever appended to, a block at a time, so a run that is killed loses at most its last block.
+
+Loading gives one record per ROI per frame written, as a structured array:
+
+    records, header = loadTrajectory('centroid_video.traj')
+    records['x'][records['roi'] == 0]
+
+Files from before the blocks were compressed (OHBTRAJ1, one 22-byte record per ROI per frame) still load.
+'''
+
+import json
+import numpy as np
+import zlib
+from zones import zoneConfig
+
+
+MAGIC = b'OHBTRAJ2'
+# One record per ROI per frame; also the layout of OHBTRAJ1 files on disk
+OLD_MAGIC = b'OHBTRAJ1'
+RECORD = np.dtype([('frame', '<u4'), ('time', '<f4'), ('x', '<f4'), ('y', '<f4'), ('area', '<f4'),
+                   ('roi', 'u1'), ('zone', 'u1')])
+NO_ZONE = 255
+NOT_WRITTEN = 254
+
+
+def readHeader(f):
+    # Returns the header and the offset of the first block
+    if f.read(len(MAGIC)) not in (MAGIC, OLD_MAGIC):
+        raise ValueError("Not a trajectory file")
+    size = int.from_bytes(f.read(4), 'little')
+    header = json.loads(f.read(size))
+
+    return header, len(MAGIC) + 4 + size
+
+
+def loadHeader(path):
+    with open(path, 'rb') as f:
+        return readHeader(f)[0]
+
+
+class TrajectoryWriter:
+    def __init__(self, path, tracker, fps=None, chunkSize=4096, append=False):
+        # chunkSize is the number of frames in a block. With append=True the blocks are added to the end of an
+        # existing file, written for the same tracker.
+        self.labels = list(tracker.labels)
+        self.zoneNames = list(tracker.zoneNames)
+        self.roiIndex = {label: i for i, label in enumerate(self.labels)}
+        self.zoneIndex = {name: i for i, name in enumerate(self.zoneNames)}
+
+        self.frames = np.zeros(chunkSize, '<u4')
+        self.times = np.zeros(chunkSize, '<f4')
+        # x, y and area of each ROI (rows) in each frame (columns), and the zone
+        self.values = np.zeros((3, len(self.labels), chunkSize), '<f4')
+        self.zones = np.full((len(self.labels), chunkSize), NOT_WRITTEN, 'u1')
+        self.count = 0
+
+        header = json.dumps({
+            'protocol': tracker.protocol,
+            'rois': self.labels,
+            'zones': self.zoneNames,
+            'arenas': [list(arena) for arena in tracker.arenas],
+            # The ROIs as selected on the video frame, for render.py
+            'frame_rois': [list(roi) for roi in tracker.ROIs],
+            # The shape of every zone, as a --zones config, so render.py draws the zones that were tracked
+            'zone_shapes': zoneConfig(tracker.zones),
+            'fps': fps,
+        }).encode()
+
+        if append:
+            with open(path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{path} is in an older format, and can't be appended to")
+                f.seek(0)
+                if readHeader(f)[0] != json.loads(header):
+                    raise ValueError(f"{path} was written with different ROIs or zones")
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC + len(header).to_bytes(4, 'little') + header)
+
+    def add(self, samples):
+        # Samples come a frame at a time, in order
+        for sample in samples:
+            if self.count == 0 or self.frames[self.count - 1] != sample.frame:
+                if self.count == len(self.frames):
+                    self.flush()
+                self.frames[self.count] = sample.frame
+                self.times[self.count] = sample.time
+                self.count += 1
+
+            i, k = self.roiIndex[sample.roi], self.count - 1
+            self.values[:, i, k] = (sample.x, sample.y, sample.area)
+            self.zones[i, k] = self.zoneIndex.get(sample.location, NO_ZONE)
+
+    def flush(self):
+        n = self.count
+        if n:
+            block = zlib.compress(b''.join([np.uint32(n).tobytes(), self.frames[:n].tobytes(),
+                                            self.times[:n].tobytes(), self.values[:, :, :n].tobytes(),
+                                            self.zones[:, :n].tobytes()]))
+            self.file.write(len(block).to_bytes(4, 'little') + block)
+            self.zones[:, :n] = NOT_WRITTEN
+            self.count = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def readBlock(data, rois):
+    # The records of one decompressed block, in frame order and then ROI order
+    n = int(np.frombuffer(data, '<u4', 1)[0])
+    offset = 4
+    frames = np.frombuffer(data, '<u4', n, offset)
+    offset += 4 * n
+    times = np.frombuffer(data, '<f4', n, offset)
+    offset += 4 * n
+    values = np.frombuffer(data, '<f4', 3 * rois * n, offset).reshape(3, rois, n)
+    offset += 12 * rois * n
+    zones = np.frombuffer(data, 'u1', rois * n, offset).reshape(rois, n)
+
+    records = np.zeros((n, rois), RECORD)
+    records['frame'] = frames[:, None]
+    records['time'] = times[:, None]
+    records['x'], records['y'], records['area'] = values.transpose(0, 2, 1)
+    records['roi'] = np.arange(rois)
+    records['zone'] = zones.T
+    records = records.ravel()
+
+    return records[records['zone'] != NOT_WRITTEN]
+
+
+def loadTrajectory(path):
+    # Returns the records (a structured array of RECORD) and the header
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        f.seek(0)
+        header, offset = readHeader(f)
+        data = f.read()
+
+    if magic == OLD_MAGIC:
+        # A run that was killed can leave a partly written record at the end
+        return np.frombuffer(data, RECORD, len(data) // RECORD.itemsize).copy(), header
+
+    blocks = []
+    position = 0
+    # A run that was killed can leave a partly written block at the end
+    while position + 4 <= len(data):
+        size = int.from_bytes(data[position:position + 4], 'little')
+        if position + 4 + size > len(data):
+            break
+        blocks.append(readBlock(zlib.decompress(data[position + 4:position + 4 + size]), len(header['rois'])))
+        position += 4 + size
+
+    return (np.concatenate(blocks) if blocks else np.zeros(0, RECORD)), header
+
+
+def toDataFrame(path):
+    # The trajectory as a DataFrame with the same columns as the CSV (rectangle, location, x, y), plus
+    # frame, time and area
+    import pandas as pd
+
+    records, header = loadTrajectory(path)
+    zones = np.array(header['zones'] + [None] * (NO_ZONE + 1 - len(header['zones'])), dtype=object)
+
+    return pd.DataFrame({
+        'frame': records['frame'],
+        'time': records['time'],
+        'rectangle': np.array(header['rois'], dtype=object)[records['roi']],
+        'location': zones[records['zone']],
+        'x': records['x'],
+        'y': records['y'],
+        'area': records['area'],
+    })
@@ -0,0 +1,135 @@
+'''
+Zones of any shape, rasterised once into a label image so classifying a point is a single array lookup.
+
+A zone is (name, shape), and a shape is one of
+    (x, y, w, h)                          a rectangle, from x up to (not including) x + w
+    {'rect': [x, y, w, h]}                the same, from JSON
+    {'circle': [cx, cy, r]}
+    {'polygon': [[x, y], [x, y], ...]}
+all in tracker coordinates. Where zones overlap, the one listed first wins. A zone config for --zones lists
+the zones of each ROI, in the order the ROIs were selected:
+
+    {"zones": [[{"name": "cup", "circle": [210, 180, 40]}, {"name": "far", "rect": [300, 100, 120, 160]}],
+               [...]]}
+'''
+
+import cv2 as cv
+import json
+import math
+import numpy as np
+
+
+def shapeOutline(shape, steps=16):
+    # Points around the edge of a shape, steps per side (or 4 * steps around a circle)
+    if isinstance(shape, dict) and 'polygon' in shape:
+        return np.array(shape['polygon'], np.float64)
+    if isinstance(shape, dict) and 'circle' in shape:
+        cx, cy, r = shape['circle']
+        t = np.linspace(0, 2 * np.pi, 4 * steps, endpoint=False)
+        return np.stack([cx + r * np.cos(t), cy + r * np.sin(t)], 1)
+
+    x, y, w, h = shape['rect'] if isinstance(shape, dict) else shape
+    t = np.linspace(0, 1, steps)
+    return np.concatenate([np.stack([x + w * t, np.full(steps, y)], 1),
+                           np.stack([np.full(steps, x + w), y + h * t], 1),
+                           np.stack([x + w * t[::-1], np.full(steps, y + h)], 1),
+                           np.stack([np.full(steps, x), y + h * t[::-1]], 1)])
+
+
+def shapeBounds(shape):
+    # Integer bounding rectangle (x, y, w, h) of a shape, edges included
+    outline = shapeOutline(shape, 2)
+    x0, y0 = np.floor(outline.min(axis=0))
+    x1, y1 = np.ceil(outline.max(axis=0))
+
+    return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+
+# Fractional bits of the coordinates circles and polygons are drawn with
+SHIFT = 4
+
+
+def fillShape(image, shape, value, origin):
+    # Draw a filled shape onto a label image whose top left pixel is at origin. Label pixel (col, row) holds
+    # the zone of every point in [col, col + 1) x [row, row + 1), so shapes are drawn half a pixel up and left
+    # of where OpenCV would put them.
+    ox, oy = origin
+    if isinstance(shape, dict) and 'circle' in shape:
+        cx, cy, r = shape['circle']
+        centre = (int(round((cx - ox - 0.5) * (1 << SHIFT))), int(round((cy - oy - 0.5) * (1 << SHIFT))))
+        cv.circle(image, centre, int(round(r * (1 << SHIFT))), value, -1, cv.LINE_8, SHIFT)
+    elif isinstance(shape, dict) and 'polygon' in shape:
+        points = np.int32(np.round((shapeOutline(shape) - origin - 0.5) * (1 << SHIFT)))
+        cv.fillPoly(image, [points], value, cv.LINE_8, SHIFT)
+    else:
+        # The points of an integer rectangle are exactly the pixels it covers
+        x, y, w, h = shape['rect'] if isinstance(shape, dict) else shape
+        cv.rectangle(image, (int(x - ox), int(y - oy)), (int(x + w - ox) - 1, int(y + h - oy) - 1), value, -1)
+
+
+class ZoneMap:
+    # Label image of one ROI's zones: 0 outside every zone, k for the k-th zone
+    def __init__(self, zones, arena):
+        self.names = [name for name, shape in zones]
+        if len(self.names) > 254:
+            raise ValueError("Too many zones in one ROI")
+
+        # Cover the arena and every zone, with a pixel to spare for the edges
+        rects = [arena] + [shapeBounds(shape) for name, shape in zones]
+        x0 = min(x for x, y, w, h in rects)
+        y0 = min(y for x, y, w, h in rects)
+        x1 = max(x + w for x, y, w, h in rects) + 1
+        y1 = max(y + h for x, y, w, h in rects) + 1
+        self.origin = (x0, y0)
+        self.labels = np.zeros((y1 - y0, x1 - x0), np.uint8)
+
+        # Paint the last zone first, so the first one listed ends up on top
+        for k in range(len(zones), 0, -1):
+            fillShape(self.labels, zones[k - 1][1], k, self.origin)
+
+    def label(self, point):
+        # Index (1-based) of the zone the point is in, 0 if none
+        col = math.floor(point[0]) - self.origin[0]
+        row = math.floor(point[1]) - self.origin[1]
+        if 0 <= row < self.labels.shape[0] and 0 <= col < self.labels.shape[1]:
+            return self.labels[row, col]
+
+        return 0
+
+    def name(self, point):
+        # Name of the zone the point is in, None if none
+        k = self.label(point)
+        return self.names[k - 1] if k else None
+
+    def coverage(self, mask, origin, scale=1.0):
+        # Number of foreground pixels of a mask in each zone, [outside, zone 1, zone 2, ...], from one bincount.
+        # origin is the position of the mask's top left pixel in tracker coordinates, and scale the mask's
+        # resolution relative to them.
+        h, w = mask.shape[:2]
+        # Label pixel under the centre of each mask pixel; pixels beyond the label image are outside every zone
+        rows = np.floor((np.arange(h) + 0.5) / scale - 0.5).astype(int) + origin[1] - self.origin[1]
+        cols = np.floor((np.arange(w) + 0.5) / scale - 0.5).astype(int) + origin[0] - self.origin[0]
+        padded = np.pad(self.labels, 1)
+        labels = padded[np.clip(rows, -1, self.labels.shape[0])[:, None] + 1,
+                        np.clip(cols, -1, self.labels.shape[1])[None, :] + 1]
+
+        return np.bincount(labels[mask > 0], minlength=len(self.names) + 1)
+
+
+def loadZones(path):
+    # Zones of each ROI from a JSON config (see above), as lists of (name, shape)
+    with open(path) as f:
+        config = json.load(f)
+
+    return parseZones(config['zones'])
+
+
+def parseZones(config):
+    # Zones of each ROI from the 'zones' list of a config
+    return [[(zone['name'], {k: v for k, v in zone.items() if k != 'name'}) for zone in roi] for roi in config]
+
+
+def zoneConfig(zones):
+    # The zones of each ROI, as lists of (name, shape), in the form of a config's 'zones' list
+    return [[{'name': name, **(shape if isinstance(shape, dict) else {'rect': list(shape)})} for name, shape in roi]
+            for roi in zones]